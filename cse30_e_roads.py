@@ -4,6 +4,18 @@ algorithm to find the shortest distance between two European cities.
 If a path does not exist, between the two given cities, the
 program says so.
 
+By default the search is A*, guided by the straight-line distance to the
+destination. It finds the same shortest paths as Dijkstra's algorithm, but
+settles far fewer cities on long routes. Options, given before the cities:
+--method=astar|dijkstra|bidirectional|ch
+                            Pick the search algorithm
+--stats                     Report the number of settled cities on stderr
+--serve[=socket_path]       Load the graph once, and answer JSON line
+                            queries on stdin/stdout or a Unix socket
+                            (see RouteServer)
+A city can also be given as a "latitude,longitude" position, which stands
+for the nearest city of the network.
+
 Sample Output
 $ python3 cse30_e_roads.py "Nizhny Novgorod" Munich
 Nizhny Novgorod
@@ -41,12 +53,70 @@ vertex_locations.txt: Contains the latitude and longitude information
 The first two files are used to create the vertices and edges of the graph.
 The information about the latitude and longitude is used to determine the
 distance between cities, which gives the weight to the edges of the graph.
+The graph is stored in compressed sparse row form (see CSRGraph), with the
+cities numbered in the order of vertex_names.txt.
+
+Parsing the files is only done when they change: the parsed graph is saved
+in a binary cache ($E_ROADS_CACHE, ~/.cache/cse30_e_roads.graph by default)
+that later runs memory-map. "cse30_e_roads.py --build-cache" rebuilds it,
+along with the contraction hierarchy used by --method=ch, which answers
+queries while settling only a small fraction of the cities.
+"cse30_e_roads.py --self-test" checks it against Dijkstra's algorithm on
+random graphs.
 """
 from __future__ import print_function
 
-from collections import defaultdict
+from array import array
+from collections import Counter, OrderedDict, defaultdict
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import heapq
+import json
 import math
+import mmap
+import multiprocessing
+import os
+import random
+import struct
 import sys
+import tempfile
+
+# Search algorithms for point-to-point queries; the first is the default.
+# 'ch' uses a ContractionHierarchy, built once per graph.
+METHODS = ('astar', 'dijkstra', 'bidirectional', 'ch')
+
+# Directory holding vertex_names.txt, vertex_locations.txt and network.txt
+DATA_DIR = '/srv/datasets/e-roads'
+DATA_FILES = ('vertex_names.txt', 'vertex_locations.txt', 'network.txt')
+
+# Compiled graph cache, see load_graph(). The header holds a magic string
+# carrying the format version, the size and modification time of each data
+# file, and the number of vertices, edges and bytes of names. It is followed
+# by the offsets, targets, weights, latitudes and longitudes arrays, and the
+# newline-separated city names.
+GRAPH_CACHE = os.environ.get('E_ROADS_CACHE') or os.path.expanduser('~/.cache/cse30_e_roads.graph')
+GRAPH_CACHE_MAGIC = b'EROADS\x00\x01'
+GRAPH_CACHE_HEADER = struct.Struct('<8s6q3q')
+
+# Contraction hierarchy cache, stored next to the graph cache. The header
+# holds the magic string, the data files' fingerprint, and the number of
+# vertices, upward and downward edges. It is followed by the ranks, then the
+# offsets, neighbors, weights and middles of the upward and downward edges.
+CH_CACHE_MAGIC = b'EROADSCH'
+CH_CACHE_HEADER = struct.Struct('<8s6q3q')
+
+# Vertices settled by a witness search during contraction, at most
+CH_WITNESS_LIMIT = 200
+
+# Cache sizes of RouteServer, and the number of queries from an origin
+# after which its whole shortest path tree is computed and cached
+ROUTE_CACHE_SIZE = 4096
+TREE_CACHE_SIZE = 32
+HOT_ORIGIN_QUERIES = 3
+
+# Graph searched by the distance_matrix() worker processes
+_worker_graph = None
 
 
 class Graph(defaultdict):
@@ -95,6 +165,209 @@ class Graph(defaultdict):
         """
         return set(self[vertex].keys())
 
+    def adjacent(self, vertex):
+        """
+        Iterate over the vertices adjacent to a vertex, with the weights of
+        the edges leading to them. This is what the search algorithms use.
+        param vertex: Vertex of interest
+        return: Iterable of (vertex, weight) pairs
+        """
+        return self.get(vertex, {}).items()
+
+    def reverse(self):
+        """
+        Create the graph with every edge reversed
+        return: The reversed Graph
+        """
+        reversed_graph = Graph()
+        for from_vertex, values in self.items():
+            for to_vertex, edge_weight in values.items():
+                reversed_graph[to_vertex][from_vertex] = edge_weight
+
+        return reversed_graph
+
+
+def csr_arrays(num_vertices, sources, columns):
+    """
+    Group a list of edges by the vertex they come from, with a counting sort.
+    param num_vertices: Number of vertices
+    param sources: Vertex id each edge comes from
+    param columns: Tuple of (typecode, values) pairs, holding the other
+                   attributes of each edge (target, weight...)
+    return: Tuple of the offsets array, in which the edges of vertex u are
+            the entries offsets[u] to offsets[u + 1] - 1, and a list of the
+            columns' arrays in that order
+    """
+    offsets = array('l', [0]) * (num_vertices + 1)
+    for from_vertex in sources:
+        offsets[from_vertex + 1] += 1
+    for vertex in range(num_vertices):
+        offsets[vertex + 1] += offsets[vertex]
+
+    sorted_columns = [array(typecode, [0]) * len(sources) for typecode, _ in columns]
+    position = offsets[:-1]
+    for i, from_vertex in enumerate(sources):
+        for sorted_column, (_, values) in zip(sorted_columns, columns):
+            sorted_column[position[from_vertex]] = values[i]
+        position[from_vertex] += 1
+
+    return offsets, sorted_columns
+
+
+class CSRGraph(Mapping):
+    """
+    The CSRGraph class stores a weighted directed graph in compressed sparse
+    row form. Vertices are numbered 0..n-1, and the edges leaving vertex u
+    are the entries offsets[u] to offsets[u + 1] - 1 of the flat targets and
+    weights arrays. A few compact arrays replace a dictionary per vertex.
+
+    The search algorithms work on vertex ids, through adjacent(). The rest of
+    the Graph API (g[city], vertices(), edges(), neighbors()) is provided as
+    a view keyed by city name, and builds its results on demand.
+    """
+
+    # ContractionHierarchy of the graph, if one has been built or loaded
+    hierarchy = None
+
+    # CityIndex of the graph, if one has been built
+    city_index = None
+
+    # The graph with every edge reversed, once reverse() has built it
+    reversed_graph = None
+
+    def __init__(self, names, locations, sources, targets, weights):
+        """
+        Build the arrays from a list of edges, given as three parallel sequences.
+        param names: List of vertex names, indexed by vertex id
+        param locations: List of (latitude, longitude) tuples, indexed by vertex id
+        param sources: Vertex id each edge comes from
+        param targets: Vertex id each edge goes to
+        param weights: Weight of each edge
+        """
+        self.names = names
+        self.locations = locations
+        self.index = {name: vertex for vertex, name in enumerate(names)}
+
+        self.offsets, (self.targets, self.weights) = \
+            csr_arrays(len(names), sources, (('l', targets), ('d', weights)))
+
+    @classmethod
+    def from_graph(cls, g: Graph, locations=None):
+        """
+        Build a CSRGraph from a Graph.
+        param g: Graph to convert
+        param locations: Optional dictionary of the (latitude, longitude) of each vertex
+        return: The new CSRGraph
+        """
+        names = sorted(g.vertices())
+        index = {name: vertex for vertex, name in enumerate(names)}
+        sources, targets, weights = array('l'), array('l'), array('d')
+        for from_vertex, values in g.items():
+            for to_vertex, edge_weight in values.items():
+                sources.append(index[from_vertex])
+                targets.append(index[to_vertex])
+                weights.append(edge_weight)
+        if locations is not None:
+            locations = [locations[name] for name in names]
+
+        return cls(names, locations, sources, targets, weights)
+
+    @classmethod
+    def from_arrays(cls, names, locations, offsets, targets, weights):
+        """
+        Wrap already built arrays (or memoryviews) in a CSRGraph.
+        param names: List of vertex names, indexed by vertex id
+        param locations: List of (latitude, longitude) tuples, indexed by vertex id
+        param offsets: Start of the edges of each vertex, plus the total
+        param targets: Vertex id each edge goes to
+        param weights: Weight of each edge
+        return: The new CSRGraph
+        """
+        g = cls.__new__(cls)
+        g.names = names
+        g.locations = locations
+        g.index = {name: vertex for vertex, name in enumerate(names)}
+        g.offsets = offsets
+        g.targets = targets
+        g.weights = weights
+
+        return g
+
+    def adjacent(self, vertex):
+        """
+        Iterate over the vertices adjacent to a vertex, with the weights of
+        the edges leading to them. Only views of the arrays are created.
+        param vertex: Vertex id of interest
+        return: Iterable of (vertex id, weight) pairs
+        """
+        start, end = self.offsets[vertex], self.offsets[vertex + 1]
+        return zip(memoryview(self.targets)[start:end], memoryview(self.weights)[start:end])
+
+    def reverse(self):
+        """
+        Create the graph with every edge reversed, sharing the names and
+        locations. It is built once and kept.
+        return: The reversed CSRGraph
+        """
+        if self.reversed_graph is None:
+            sources = array('l')
+            for vertex in range(len(self.names)):
+                sources.extend([vertex] * (self.offsets[vertex + 1] - self.offsets[vertex]))
+            offsets, (targets, weights) = \
+                csr_arrays(len(self.names), self.targets, (('l', sources), ('d', self.weights)))
+            self.reversed_graph = CSRGraph.from_arrays(self.names, self.locations,
+                                                       offsets, targets, weights)
+            self.reversed_graph.reversed_graph = self
+
+        return self.reversed_graph
+
+    def __getitem__(self, vertex):
+        """
+        Return the neighbors of a city, with the weights of the edges
+        param vertex: City name
+        return: Dictionary of neighboring city names to weights, empty for a
+                city without edges leaving it
+        """
+        return {self.names[to_vertex]: edge_weight
+                for to_vertex, edge_weight in self.adjacent(self.index[vertex])}
+
+    def __iter__(self):
+        """
+        Iterate over the names of all the cities
+        """
+        return iter(self.names)
+
+    def __len__(self):
+        """
+        Return the number of cities
+        """
+        return len(self.names)
+
+    def vertices(self):
+        """
+        Return all the vertices of the graph, including those that only
+        have edges coming into them
+        return: Set of vertices
+        """
+        return set(self.names)
+
+    def edges(self):
+        """
+        Find all the edges in the graph
+        return: The set of edges
+        """
+        return {(self.names[from_vertex], self.names[self.targets[i]], self.weights[i])
+                for from_vertex in range(len(self.names))
+                for i in range(self.offsets[from_vertex], self.offsets[from_vertex + 1])}
+
+    def neighbors(self, vertex):
+        """
+        Set of all vertices for which a path exists from the given vertex
+        param vertex: Vertex of interest
+        return: Set of vertices adjacent to the input vertex
+        """
+        return set(self[vertex].keys())
+
 
 def haversine(pos1, pos2):
     """
@@ -121,145 +394,1358 @@ def haversine(pos1, pos2):
     return d
 
 
-def shortest_path(g: Graph, node_1: str, node_2: str, num_args):
+def import_numpy():
     """
-    Implement Dijsktra's shortest path algorithm.
-    param g: Graph formed from the data provided
-    param node_1: Start node
+    Import NumPy, which is optional; pure Python fallbacks are used without
+    it. It is only imported where it is used, as importing it takes far
+    longer than loading the graph from its cache.
+    return: The numpy module, or None if it is not installed
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+
+    return numpy
+
+
+def haversine_many(lat1, lon1, lat2, lon2):
+    """
+    Vectorized version of haversine(), for NumPy arrays of coordinates. The
+    degrees are converted to radians once per array, and each trigonometric
+    function runs over all the pairs of positions in one call.
+    param lat1: Array of latitudes of the first locations
+    param lon1: Array of longitudes of the first locations
+    param lat2: Array of latitudes of the second locations
+    param lon2: Array of longitudes of the second locations
+    return: Array of the distances between the pairs of points, in metres
+    """
+    np = import_numpy()
+    lat1, lon1, lat2, lon2 = (np.asarray(values, dtype=float) for values in (lat1, lon1, lat2, lon2))
+    phi1 = lat1 * math.pi / 180
+    phi2 = lat2 * math.pi / 180
+    delta_phi = (lat2 - lat1) * math.pi / 180
+    delta_lambda = (lon2 - lon1) * math.pi / 180
+
+    sin_delta_phi = np.sin(delta_phi / 2)
+    sin_delta_lambda = np.sin(delta_lambda / 2)
+    a = sin_delta_phi * sin_delta_phi + np.cos(phi1) * np.cos(phi2) * \
+        sin_delta_lambda * sin_delta_lambda
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return 6371e3 * c  # in metres
+
+
+def build_path(previous_vertex, node_2):
+    """
+    Create the path by going through the table of previous vertices
+    param previous_vertex: Dictionary of the previous vertex of each vertex,
+                           None for the start node
     param node_2: Destination Node
-    return: None
+    return: List of nodes from the start node to node_2
     """
-    visited = set()
-    unvisited = g.vertices()
+    path = [node_2]
+    while previous_vertex[path[-1]] is not None:
+        path.append(previous_vertex[path[-1]])
+    path.reverse()
 
-    vertex_weights = dict()
-    for node in unvisited:
-        vertex_weights[node] = float('inf')
+    return path
 
-    unvisited_vertex_weights = vertex_weights.copy()
-    vertex_weights[node_1] = 0
 
-    previous_vertex = {node_1: node_1}
-    current_node = node_1
+def shortest_path_tree(g: Graph, node_1, targets=None, stats=None):
+    """
+    Run Dijkstra's algorithm from a start node, with a binary heap as the
+    priority queue. Outdated heap entries are skipped when popped rather than
+    removed, and the search stops as soon as all the targets are settled.
+    param g: Graph or CSRGraph formed from the data provided
+    param node_1: Start node
+    param targets: Nodes whose distance is needed, or None for all nodes
+    param stats: If given, a dictionary in which 'settled' is set to the
+                 number of vertices settled by the search
+    return: Tuple of two dictionaries: the distance of each settled node,
+            and the previous node on the way to each reached node
+    """
+    distances = dict()
+    vertex_weights = {node_1: 0}
+    previous_vertex = {node_1: None}
+    remaining = None if targets is None else set(targets)
+    heap = [(0, node_1)]
 
-    while unvisited != ():
-        neighbors = list(g.neighbors(current_node) - visited)
+    while heap:
+        weight, current_node = heapq.heappop(heap)
+        if current_node in distances:
+            continue
+        distances[current_node] = weight
+        if remaining is not None:
+            remaining.discard(current_node)
+            if not remaining:
+                break
 
-        for next_node in neighbors:
-            new_vertex_weight = g[current_node][next_node] + vertex_weights[current_node]
-            if new_vertex_weight < vertex_weights[next_node]:
+        for next_node, edge_weight in g.adjacent(current_node):
+            new_vertex_weight = weight + edge_weight
+            if new_vertex_weight < vertex_weights.get(next_node, float('inf')):
                 vertex_weights[next_node] = new_vertex_weight
-                unvisited_vertex_weights[next_node] = new_vertex_weight
                 previous_vertex[next_node] = current_node
+                heapq.heappush(heap, (new_vertex_weight, next_node))
+
+    if stats is not None:
+        stats['settled'] = len(distances)
+
+    return distances, previous_vertex
+
+
+def dijkstra(g: Graph, node_1: str, node_2: str, stats=None):
+    """
+    Implement Dijkstra's shortest path algorithm, stopping as soon as the
+    destination is settled.
+    param g: Graph or CSRGraph formed from the data provided
+    param node_1: Start node
+    param node_2: Destination Node
+    param stats: If given, a dictionary in which 'settled' is set to the
+                 number of vertices settled by the search
+    return: Tuple of the distance and the list of nodes on the path, or
+            (inf, []) if no path exists
+    """
+    distances, previous_vertex = shortest_path_tree(g, node_1, (node_2,), stats)
+
+    if node_2 not in distances:
+        return float('inf'), []
 
-        unvisited.remove(current_node)
-        visited.add(current_node)
-        del unvisited_vertex_weights[current_node]
+    return distances[node_2], build_path(previous_vertex, node_2)
 
-        # To get the next node, we must find the unvisited node with the lowest weight.
-        # This information is being maintained in the unvisited_vertex_weights dictionary.
-        # Sort this by value and pick the 0th element for the next node
-        current_node = ([k for k, v in sorted(unvisited_vertex_weights.items(),
-                                              key=lambda item: item[1])])[0]
 
+def a_star(g: Graph, node_1: str, node_2: str, locations, stats=None):
+    """
+    Implement the A* shortest path algorithm. Vertices are taken from the heap
+    in the order of their distance from the start plus their straight-line
+    distance to the destination. Edge weights are straight-line distances
+    too, so that estimate never exceeds the remaining road distance, and the
+    path found is a shortest one.
+    param g: Graph or CSRGraph formed from the data provided
+    param node_1: Start node
+    param node_2: Destination Node
+    param locations: Dictionary of the (latitude, longitude) of each node
+    param stats: If given, a dictionary in which 'settled' is set to the
+                 number of vertices settled by the search
+    return: Tuple of the distance and the list of nodes on the path, or
+            (inf, []) if no path exists
+    """
+    destination = locations[node_2]
+    remaining = {node_1: haversine(locations[node_1], destination)}
+    vertex_weights = {node_1: 0}
+    previous_vertex = {node_1: None}
+    settled = 0
+    heap = [(remaining[node_1], 0, node_1)]
+
+    while heap:
+        _, weight, current_node = heapq.heappop(heap)
+        # Skip outdated entries, whose vertex has been reached by a shorter path since
+        if weight > vertex_weights[current_node]:
+            continue
         if current_node == node_2:
-            if node_2 not in previous_vertex.keys():
-                print('No path exists between', node_1, 'and', node_2, file=sys.stderr)
-                sys.exit(1)
             break
+        settled += 1
 
-    if unvisited == ():
-        print('No path exists between', node_1, 'and', node_2, file=sys.stderr)
-        sys.exit(1)
+        for next_node, edge_weight in g.adjacent(current_node):
+            new_vertex_weight = weight + edge_weight
+            if new_vertex_weight < vertex_weights.get(next_node, float('inf')):
+                vertex_weights[next_node] = new_vertex_weight
+                previous_vertex[next_node] = current_node
+                if next_node not in remaining:
+                    remaining[next_node] = haversine(locations[next_node], destination)
+                heapq.heappush(heap, (new_vertex_weight + remaining[next_node],
+                                      new_vertex_weight, next_node))
+    else:
+        current_node = None
+
+    if stats is not None:
+        stats['settled'] = settled
+
+    if current_node != node_2:
+        return float('inf'), []
+
+    return vertex_weights[node_2], build_path(previous_vertex, node_2)
+
+
+def bidirectional_dijkstra(g: Graph, node_1, node_2, stats=None):
+    """
+    Implement a bidirectional Dijkstra's algorithm: search forward from the
+    start node and backward from the destination at the same time, always
+    advancing the search whose next vertex is closest. Whenever an edge
+    reaches a vertex already reached by the other search, the path through
+    it is a candidate. Once the two next vertices' distances add up to at
+    least the best candidate, no shorter path can remain. If either search
+    runs out of vertices, its side's component is exhausted, so the best
+    candidate (or the lack of one) is final.
+    param g: Graph or CSRGraph formed from the data provided
+    param node_1: Start node
+    param node_2: Destination Node
+    param stats: If given, a dictionary in which 'settled' is set to the
+                 number of vertices settled by the two searches
+    return: Tuple of the distance and the list of nodes on the path, or
+            (inf, []) if no path exists
+    """
+    graphs = (g, g.reverse())
+    vertex_weights = ({node_1: 0}, {node_2: 0})
+    previous_vertex = ({node_1: None}, {node_2: None})
+    visited = (set(), set())
+    heaps = ([(0, node_1)], [(0, node_2)])
+    best, meeting = (0, node_1) if node_1 == node_2 else (float('inf'), None)
+
+    while heaps[0] and heaps[1] and heaps[0][0][0] + heaps[1][0][0] < best:
+        side = 0 if heaps[0][0] <= heaps[1][0] else 1
+        weight, current_node = heapq.heappop(heaps[side])
+        if current_node in visited[side]:
+            continue
+        visited[side].add(current_node)
+
+        other_weights = vertex_weights[1 - side]
+        for next_node, edge_weight in graphs[side].adjacent(current_node):
+            new_vertex_weight = weight + edge_weight
+            if new_vertex_weight < vertex_weights[side].get(next_node, float('inf')):
+                vertex_weights[side][next_node] = new_vertex_weight
+                previous_vertex[side][next_node] = current_node
+                heapq.heappush(heaps[side], (new_vertex_weight, next_node))
+                if next_node in other_weights and \
+                        new_vertex_weight + other_weights[next_node] < best:
+                    best, meeting = new_vertex_weight + other_weights[next_node], next_node
+
+    if stats is not None:
+        stats['settled'] = len(visited[0]) + len(visited[1])
+
+    if meeting is None:
+        return float('inf'), []
+
+    path = build_path(previous_vertex[0], meeting)
+    node = meeting
+    while previous_vertex[1][node] is not None:
+        node = previous_vertex[1][node]
+        path.append(node)
+
+    return path_length(g, path), path
+
+
+def path_length(g: Graph, path):
+    """
+    Add up the weights of the edges along a path, from its start, as the
+    searches do. Searches that meet in the middle use this to report exactly
+    the same distance as dijkstra().
+    param g: Graph or CSRGraph formed from the data provided
+    param path: List of nodes
+    return: Length of the path
+    """
+    distance = 0
+    for from_vertex, to_vertex in zip(path, path[1:]):
+        distance += min(edge_weight for next_node, edge_weight in g.adjacent(from_vertex)
+                        if next_node == to_vertex)
+
+    return distance
+
+
+class ContractionHierarchy:
+    """
+    The ContractionHierarchy class answers shortest path queries on a
+    CSRGraph by searching only a small part of it.
+
+    Preprocessing contracts the vertices one at a time, cheapest first: a
+    contracted vertex is removed from the graph, and a shortcut edge is
+    added between two of its neighbors whenever the path through it was
+    their only shortest connection. Each vertex gets the rank at which it
+    was contracted. A shortest path then always climbs to a highest-ranked
+    vertex and comes down again, so a query runs a forward search from the
+    source and a backward search from the destination, both only following
+    edges to higher ranks, and meets at the top. Shortcuts remember the
+    vertex they bypass, so the path can be unpacked into original edges.
+
+    up holds, for each vertex, the edges to higher-ranked vertices; down
+    holds the edges from higher-ranked vertices, stored at their lower end.
+    Both are (offsets, neighbors, weights, middles) tuples of CSR arrays,
+    where the middle of an original edge is -1.
+    """
+
+    def __init__(self, rank, up, down):
+        """
+        Wrap the arrays of a hierarchy.
+        param rank: Contraction rank of each vertex
+        param up: CSR arrays of the upward edges
+        param down: CSR arrays of the downward edges
+        """
+        self.rank = rank
+        self.up = up
+        self.down = down
+
+    @classmethod
+    def build(cls, g: CSRGraph):
+        """
+        Contract all the vertices of a graph.
+        param g: CSRGraph to preprocess
+        return: The new ContractionHierarchy
+        """
+        num_vertices = len(g.names)
+        out_edges = [dict() for _ in range(num_vertices)]
+        in_edges = [dict() for _ in range(num_vertices)]
+        for from_vertex in range(num_vertices):
+            for to_vertex, edge_weight in g.adjacent(from_vertex):
+                if to_vertex != from_vertex and \
+                        edge_weight < out_edges[from_vertex].get(to_vertex, (float('inf'),))[0]:
+                    out_edges[from_vertex][to_vertex] = (edge_weight, -1)
+                    in_edges[to_vertex][from_vertex] = (edge_weight, -1)
+
+        contracted_neighbors = [0] * num_vertices
+
+        def witness_distances(from_vertex, skipped, max_weight, targets):
+            """
+            Search from a vertex for paths avoiding the vertex being
+            contracted, up to a bounded effort. Paths that are missed only
+            cause unneeded shortcuts.
+            """
+            vertex_weights = {from_vertex: 0}
+            heap = [(0, from_vertex)]
+            remaining = len(targets)
+            settled = 0
+            while heap and remaining and settled < CH_WITNESS_LIMIT:
+                weight, current_node = heapq.heappop(heap)
+                if weight > vertex_weights[current_node]:
+                    continue
+                if weight > max_weight:
+                    break
+                settled += 1
+                if current_node in targets:
+                    remaining -= 1
+                for next_node, (edge_weight, _) in out_edges[current_node].items():
+                    new_vertex_weight = weight + edge_weight
+                    if next_node != skipped and \
+                            new_vertex_weight < vertex_weights.get(next_node, float('inf')):
+                        vertex_weights[next_node] = new_vertex_weight
+                        heapq.heappush(heap, (new_vertex_weight, next_node))
+            return vertex_weights
+
+        def contraction(vertex):
+            """
+            Find the shortcuts needed to contract a vertex, and its priority:
+            vertices adding few shortcuts for the edges they remove, and
+            with few contracted neighbors, go first.
+            """
+            shortcuts = []
+            for from_vertex, (in_weight, _) in in_edges[vertex].items():
+                targets = {to_vertex: in_weight + out_weight
+                           for to_vertex, (out_weight, _) in out_edges[vertex].items()
+                           if to_vertex != from_vertex}
+                if not targets:
+                    continue
+                witness = witness_distances(from_vertex, vertex, max(targets.values()), targets)
+                for to_vertex, weight in targets.items():
+                    if witness.get(to_vertex, float('inf')) > weight:
+                        shortcuts.append((from_vertex, to_vertex, weight))
+
+            priority = len(shortcuts) - len(in_edges[vertex]) - len(out_edges[vertex]) \
+                + contracted_neighbors[vertex]
+            return priority, shortcuts
+
+        heap = [(contraction(vertex)[0], vertex) for vertex in range(num_vertices)]
+        heapq.heapify(heap)
+        rank = array('l', [0]) * num_vertices
+        up = (array('l'), array('l'), array('d'), array('l'))
+        down = (array('l'), array('l'), array('d'), array('l'))
+        next_rank = 0
+
+        while heap:
+            _, vertex = heapq.heappop(heap)
+            # Priorities change as neighbors get contracted; update lazily
+            priority, shortcuts = contraction(vertex)
+            if heap and priority > heap[0][0]:
+                heapq.heappush(heap, (priority, vertex))
+                continue
+
+            rank[vertex] = next_rank
+            next_rank += 1
+            for edges, adjacent in ((up, out_edges[vertex]), (down, in_edges[vertex])):
+                for neighbor, (edge_weight, middle) in adjacent.items():
+                    for column, value in zip(edges, (vertex, neighbor, edge_weight, middle)):
+                        column.append(value)
+
+            for from_vertex in in_edges[vertex]:
+                del out_edges[from_vertex][vertex]
+                contracted_neighbors[from_vertex] += 1
+            for to_vertex in out_edges[vertex]:
+                del in_edges[to_vertex][vertex]
+                contracted_neighbors[to_vertex] += 1
+            out_edges[vertex] = in_edges[vertex] = None
+
+            for from_vertex, to_vertex, weight in shortcuts:
+                if weight < out_edges[from_vertex].get(to_vertex, (float('inf'),))[0]:
+                    out_edges[from_vertex][to_vertex] = (weight, vertex)
+                    in_edges[to_vertex][from_vertex] = (weight, vertex)
+
+        def to_csr(edges):
+            offsets, columns = csr_arrays(num_vertices, edges[0],
+                                          (('l', edges[1]), ('d', edges[2]), ('l', edges[3])))
+            return (offsets, *columns)
+
+        return cls(rank, to_csr(up), to_csr(down))
+
+    def save(self, path, fingerprint):
+        """
+        Write the hierarchy to a cache file.
+        param path: Cache file
+        param fingerprint: data_fingerprint() of the files the graph was built from
+        return: None
+        """
+        chunks = [CH_CACHE_HEADER.pack(CH_CACHE_MAGIC, *fingerprint, len(self.rank),
+                                       len(self.up[1]), len(self.down[1])),
+                  array('q', self.rank)]
+        for edges in (self.up, self.down):
+            chunks += [array('q', edges[0]), array('q', edges[1]),
+                       array('d', edges[2]), array('q', edges[3])]
+
+        write_cache_file(path, chunks)
+
+    @classmethod
+    def open(cls, path, fingerprint=None):
+        """
+        Memory-map a hierarchy written by save().
+        param path: Cache file
+        param fingerprint: If given, the expected data_fingerprint()
+        return: ContractionHierarchy, or None if the file is missing, stale,
+                truncated or not a cache
+        """
+        mapped = map_cache_file(path, CH_CACHE_HEADER, CH_CACHE_MAGIC, fingerprint)
+        if mapped is None:
+            return None
+        (num_vertices, num_up, num_down), view = mapped
+
+        sections = cache_sections(view, CH_CACHE_HEADER.size, (
+            ('q', num_vertices),
+            ('q', num_vertices + 1), ('q', num_up), ('d', num_up), ('q', num_up),
+            ('q', num_vertices + 1), ('q', num_down), ('d', num_down), ('q', num_down)))
+        if sections is None:
+            return None
+
+        return cls(sections[0], tuple(sections[1:5]), tuple(sections[5:9]))
+
+    def edge_middle(self, from_vertex, to_vertex):
+        """
+        Find the vertex bypassed by the edge between two vertices.
+        param from_vertex: Start of the edge
+        param to_vertex: End of the edge
+        return: Tuple of the middle vertex (-1 for an original edge) and the weight
+        """
+        if self.rank[from_vertex] < self.rank[to_vertex]:
+            (offsets, neighbors, weights, middles), vertex, neighbor = \
+                self.up, from_vertex, to_vertex
+        else:
+            (offsets, neighbors, weights, middles), vertex, neighbor = \
+                self.down, to_vertex, from_vertex
+
+        for i in range(offsets[vertex], offsets[vertex + 1]):
+            if neighbors[i] == neighbor:
+                return middles[i], weights[i]
+
+        raise KeyError((from_vertex, to_vertex))
+
+    def query(self, node_1, node_2, stats=None):
+        """
+        Find the shortest path between two vertices.
+        param node_1: Start vertex id
+        param node_2: Destination vertex id
+        param stats: If given, a dictionary in which 'settled' is set to the
+                     number of vertices settled by the two searches
+        return: Tuple of the distance and the list of vertex ids on the path,
+                or (inf, []) if no path exists
+        """
+        vertex_weights = ({node_1: 0}, {node_2: 0})
+        previous_vertex = ({node_1: None}, {node_2: None})
+        heaps = ([(0, node_1)], [(0, node_2)])
+        best, meeting = float('inf'), None
+        settled = 0
+
+        while heaps[0] or heaps[1]:
+            # Advance the search whose next vertex is closest
+            side = 0 if heaps[0] and (not heaps[1] or heaps[0][0] <= heaps[1][0]) else 1
+            weight, current_node = heapq.heappop(heaps[side])
+            if weight > vertex_weights[side][current_node]:
+                continue
+            # Neither search can improve on the best path found any more
+            if weight >= best:
+                break
+            settled += 1
+
+            other_weight = vertex_weights[1 - side].get(current_node)
+            if other_weight is not None and weight + other_weight < best:
+                best, meeting = weight + other_weight, current_node
+
+            offsets, neighbors, weights, _ = self.up if side == 0 else self.down
+            for i in range(offsets[current_node], offsets[current_node + 1]):
+                next_node = neighbors[i]
+                new_vertex_weight = weight + weights[i]
+                if new_vertex_weight < vertex_weights[side].get(next_node, float('inf')):
+                    vertex_weights[side][next_node] = new_vertex_weight
+                    previous_vertex[side][next_node] = current_node
+                    heapq.heappush(heaps[side], (new_vertex_weight, next_node))
+
+        if stats is not None:
+            stats['settled'] = settled
+
+        if meeting is None:
+            return float('inf'), []
+
+        # The searches' paths, in terms of possibly shortcut edges
+        packed = build_path(previous_vertex[0], meeting)
+        node = meeting
+        while previous_vertex[1][node] is not None:
+            node = previous_vertex[1][node]
+            packed.append(node)
+
+        # Replace each shortcut by the two edges it stands for, and add up
+        # the original edge weights in path order, as dijkstra() does
+        path = [packed[0]]
+        distance = 0
+        stack = list(zip(packed[-2::-1], packed[:0:-1]))
+        while stack:
+            from_vertex, to_vertex = stack.pop()
+            middle, edge_weight = self.edge_middle(from_vertex, to_vertex)
+            if middle == -1:
+                path.append(to_vertex)
+                distance += edge_weight
+            else:
+                stack.append((middle, to_vertex))
+                stack.append((from_vertex, middle))
+
+        return distance, path
 
-    # Create the path by going through the table of previous vertices
-    previous_node = node_2
-    reversed_path = [node_2]
 
-    while previous_node != node_1:
-        reversed_path.append(previous_vertex[previous_node])
-        previous_node = previous_vertex[previous_node]
+def find_route(g: CSRGraph, city_1: str, city_2: str, method=METHODS[0], stats=None):
+    """
+    Find the shortest path between two cities, given by name.
+    param g: CSRGraph formed from the data provided
+    param city_1: Start city
+    param city_2: Destination city
+    param method: Search algorithm, one of METHODS. A* needs the locations
+                  of the cities, and falls back to Dijkstra's algorithm for
+                  a graph without them.
+    param stats: If given, a dictionary filled in by the search algorithm
+    return: Tuple of the distance and the list of cities on the path, or
+            (inf, []) if no path exists
+    """
+    node_1, node_2 = g.index[city_1], g.index[city_2]
+    if method == 'astar' and g.locations is not None:
+        distance, path = a_star(g, node_1, node_2, g.locations, stats)
+    elif method == 'bidirectional':
+        distance, path = bidirectional_dijkstra(g, node_1, node_2, stats)
+    elif method == 'ch':
+        if g.hierarchy is None:
+            g.hierarchy = ContractionHierarchy.build(g)
+        distance, path = g.hierarchy.query(node_1, node_2, stats)
+    else:
+        distance, path = dijkstra(g, node_1, node_2, stats)
+
+    return distance, [g.names[node] for node in path]
+
+
+class CityIndex:
+    """
+    The CityIndex class finds the cities nearest to a position, with a k-d
+    tree. Positions are mapped to points on the unit sphere, where the
+    straight-line distance between two points grows with the great-circle
+    distance between them, so the nearest points are the nearest cities.
+
+    The tree is implicit: order lists the vertex ids such that for every
+    range [lo, hi) of the tree, the median entry mid = (lo + hi) // 2 splits
+    the range along axis[mid], with smaller coordinates before it.
+    """
+
+    def __init__(self, g: CSRGraph):
+        """
+        Build the tree over the cities of a graph that have a location and
+        at least one edge, so that positions snap onto the road network.
+        param g: CSRGraph formed from the data provided
+        """
+        self.g = g
+        self.points = dict()
+        for vertex, location in enumerate(g.locations):
+            if location is not None and g.offsets[vertex] < g.offsets[vertex + 1]:
+                self.points[vertex] = unit_vector(location)
+
+        order = list(self.points)
+        self.axis = array('b', [0]) * len(order)
+        stack = [(0, len(order))]
+        while stack:
+            lo, hi = stack.pop()
+            if hi - lo < 2:
+                continue
+            # Split along the axis on which the points are most spread out
+            spreads = [max(self.points[v][i] for v in order[lo:hi])
+                       - min(self.points[v][i] for v in order[lo:hi]) for i in range(3)]
+            axis = spreads.index(max(spreads))
+            order[lo:hi] = sorted(order[lo:hi], key=lambda v: self.points[v][axis])
+            mid = (lo + hi) // 2
+            self.axis[mid] = axis
+            stack.append((lo, mid))
+            stack.append((mid + 1, hi))
+
+        self.order = array('l', order)
+
+    def nearest(self, latitude, longitude, k=1):
+        """
+        Find the k cities nearest to a position.
+        param latitude: Latitude of the position, in degrees
+        param longitude: Longitude of the position, in degrees
+        param k: Number of cities
+        return: List of (city name, distance in metres) tuples, nearest first,
+                empty if k < 1
+        """
+        if k < 1:
+            return []
+
+        query = unit_vector((latitude, longitude))
+        # Max-heap, by negated squared distance, of the k best candidates
+        best = []
+
+        def search(lo, hi):
+            if lo >= hi:
+                return
+            mid = (lo + hi) // 2
+            vertex = self.order[mid]
+            point = self.points[vertex]
+            distance = sum((q - p) * (q - p) for q, p in zip(query, point))
+            if len(best) < k:
+                heapq.heappush(best, (-distance, vertex))
+            elif distance < -best[0][0]:
+                heapq.heapreplace(best, (-distance, vertex))
+
+            difference = query[self.axis[mid]] - point[self.axis[mid]]
+            near, far = ((lo, mid), (mid + 1, hi)) if difference < 0 else ((mid + 1, hi), (lo, mid))
+            search(*near)
+            # The other side can only help if the splitting plane is closer
+            # than the worst candidate so far
+            if len(best) < k or difference * difference < -best[0][0]:
+                search(*far)
+
+        search(0, len(self.order))
+
+        return sorted(((self.g.names[vertex],
+                        haversine((latitude, longitude), self.g.locations[vertex]))
+                       for _, vertex in best), key=lambda item: item[1])
+
+
+def unit_vector(location):
+    """
+    Map a position to a point on the unit sphere.
+    param location: Tuple of latitude and longitude, in degrees
+    return: Tuple of the x, y, z coordinates of the point
+    """
+    phi = location[0] * math.pi / 180
+    lam = location[1] * math.pi / 180
+    return math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi)
+
+
+def nearest_city(g: CSRGraph, latitude, longitude, k=1):
+    """
+    Find the cities of the road network nearest to a position. The graph's
+    CityIndex is built on first use.
+    param g: CSRGraph formed from the data provided
+    param latitude: Latitude of the position, in degrees
+    param longitude: Longitude of the position, in degrees
+    param k: Number of cities
+    return: List of (city name, distance in metres) tuples, nearest first
+    """
+    if g.city_index is None:
+        g.city_index = CityIndex(g)
+
+    return g.city_index.nearest(latitude, longitude, k)
+
+
+def find_route_from_positions(g: CSRGraph, position_1, position_2, method=METHODS[0],
+                              stats=None):
+    """
+    Find the shortest path between the cities nearest to two positions.
+    param g: CSRGraph formed from the data provided
+    param position_1: Tuple of the latitude and longitude of the start
+    param position_2: Tuple of the latitude and longitude of the destination
+    param method: Search algorithm, one of METHODS
+    param stats: If given, a dictionary filled in by the search algorithm
+    return: Tuple of the road distance between the two cities, and the list
+            of cities on the path, or (inf, []) if no path exists
+    """
+    (city_1, _), = nearest_city(g, *position_1)
+    (city_2, _), = nearest_city(g, *position_2)
+
+    return find_route(g, city_1, city_2, method, stats)
+
+
+def parse_city(g: CSRGraph, argument):
+    """
+    Interpret a command line city: either a city name, or a "latitude,longitude"
+    position, which stands for the nearest city.
+    param g: CSRGraph formed from the data provided
+    param argument: Command line argument
+    return: City name, or None if argument is neither a city nor a position
+    """
+    if argument in g.index:
+        return argument
+
+    try:
+        latitude, longitude = (float(value) for value in argument.split(','))
+    except ValueError:
+        return None
+
+    (city, _), = nearest_city(g, latitude, longitude)
+    return city
+
+
+def distance_matrix_row(g: CSRGraph, source, targets, predecessors):
+    """
+    Compute one row of a distance matrix.
+    param g: CSRGraph formed from the data provided
+    param source: Start vertex id
+    param targets: List of destination vertex ids
+    param predecessors: Also return the shortest path tree
+    return: Tuple of the distances to the targets, and the previous vertex
+            id of each settled vertex (-1 elsewhere) or None
+    """
+    distances, previous_vertex = shortest_path_tree(g, source, targets)
+    row = array('d', (distances.get(target, float('inf')) for target in targets))
+
+    tree = None
+    if predecessors:
+        tree = array('l', [-1]) * len(g.names)
+        for vertex in distances:
+            if previous_vertex[vertex] is not None:
+                tree[vertex] = previous_vertex[vertex]
+
+    return row, tree
+
+
+def _distance_matrix_task(source, targets, predecessors):
+    """
+    Compute one row of a distance matrix in a worker process.
+    """
+    return distance_matrix_row(_worker_graph, source, targets, predecessors)
+
+
+def distance_matrix(g: CSRGraph, sources, targets, workers=None, predecessors=False):
+    """
+    Compute the road distances from each of a list of cities to each of
+    another. There is one search per source city, which stops once all the
+    targets are settled. The searches are spread over a pool of forked
+    worker processes, which share the parent's copy of the graph; with a
+    memory-mapped graph (see load_graph()), its pages are not even copied.
+    param g: CSRGraph formed from the data provided
+    param sources: List of start city names
+    param targets: List of destination city names
+    param workers: Number of worker processes, all CPUs by default
+    param predecessors: Also return the shortest path trees, see tree_path()
+    return: Matrix of distances, with a row per source and a column per
+            target, inf where there is no path (a NumPy array if NumPy is
+            available, a list of lists otherwise). With predecessors, a
+            tuple of the matrix and the list of trees, one per source.
+    """
+    global _worker_graph
+
+    source_ids = [g.index[city] for city in sources]
+    target_ids = [g.index[city] for city in targets]
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1 or len(source_ids) <= 1:
+        results = [distance_matrix_row(g, source, target_ids, predecessors)
+                   for source in source_ids]
+    else:
+        _worker_graph = g
+        try:
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork')) \
+                    as executor:
+                chunk_size = max(1, len(source_ids) // (4 * workers))
+                results = list(executor.map(_distance_matrix_task, source_ids,
+                                            [target_ids] * len(source_ids),
+                                            [predecessors] * len(source_ids),
+                                            chunksize=chunk_size))
+        finally:
+            _worker_graph = None
+
+    np = import_numpy()
+    if np is not None:
+        matrix = np.array([row for row, _ in results], dtype=float).reshape(
+            len(source_ids), len(target_ids))
+    else:
+        matrix = [list(row) for row, _ in results]
+
+    if predecessors:
+        return matrix, [tree for _, tree in results]
+    return matrix
+
+
+def tree_path(g: CSRGraph, tree, city):
+    """
+    Extract the path to a city from a shortest path tree of distance_matrix().
+    param g: CSRGraph formed from the data provided
+    param tree: Previous vertex id of each vertex, -1 for the root and
+                unreached vertices
+    param city: Destination city name
+    return: List of city names from the tree's source to city, which is
+            just [city] for the source and unreached cities
+    """
+    path = [g.index[city]]
+    while tree[path[-1]] != -1:
+        path.append(tree[path[-1]])
+
+    return [g.names[node] for node in reversed(path)]
+
+
+def maps_url(g: CSRGraph, path):
+    """
+    Construct a URL giving latitudes and longitudes of the cities
+    param g: CSRGraph formed from the data provided
+    param path: List of city names
+    return: Google Maps directions URL
+    """
+    my_url = 'https://www.google.com/maps/dir/'
+    for i in path:
+        (lat, lon) = g.locations[g.index[i]]
+        my_url += '{:0.3f}'.format(lat) + ',' + '{:0.3f}'.format(lon) + '/'
+
+    return my_url
+
+
+def shortest_path(g: CSRGraph, node_1: str, node_2: str, num_args, method=METHODS[0],
+                  show_stats=False):
+    """
+    Print the shortest path between two cities, either as a list of cities
+    or as a Google Maps URL. Exit if there is no path.
+    param g: CSRGraph formed from the data provided
+    param node_1: Start node
+    param node_2: Destination Node
+    param num_args: 2 to print the cities, otherwise print the URL
+    param method: Search algorithm, one of METHODS
+    param show_stats: Print the number of settled vertices to stderr
+    return: None
+    """
+    stats = dict()
+    _, path = find_route(g, node_1, node_2, method, stats)
+
+    if show_stats:
+        print('Settled', stats['settled'], 'vertices', file=sys.stderr)
+
+    if not path:
+        print('No path exists between', node_1, 'and', node_2, file=sys.stderr)
+        sys.exit(1)
 
     if num_args == 2:
-        for i in list(reversed(reversed_path)):
+        for i in path:
             print(i)
     else:
-        # Construct a URL giving latitudes and longitudes of the cities
+        print(maps_url(g, path))
 
-        my_url = 'https://www.google.com/maps/dir/'
-        for i in list(reversed(reversed_path)):
-            (lat, lon) = city_location[i]
-            my_url += '{:0.3f}'.format(lat) + ',' + '{:0.3f}'.format(lon) + '/'
-        print(my_url)
 
+class RouteServer:
+    """
+    The RouteServer class answers route queries against a graph loaded once,
+    for a long-running process. Queries are JSON objects, one per line:
+    {"from": city_1, "to": city_2, "format": "cities" or "url"}
+    Answers are JSON objects too, one per line. On success, "ok" is true and
+    "output" holds exactly what the command line program prints: the cities
+    one per line, or the Google Maps URL. Otherwise "ok" is false and
+    "error" holds the program's error message.
 
-if __name__ == '__main__':
-    # Create a list of all the cities
-    city_list = [None]
-    with open('/srv/datasets/e-roads/vertex_names.txt', 'r') as fh:
-        cities = fh.readlines()
+    Recent routes are kept in an LRU cache. Origins that are queried often
+    get their whole shortest path tree computed and cached, which answers
+    all later queries from them.
+    """
+
+    def __init__(self, g: CSRGraph, method=METHODS[0], route_cache_size=ROUTE_CACHE_SIZE,
+                 tree_cache_size=TREE_CACHE_SIZE):
+        """
+        Set up the server and its caches.
+        param g: CSRGraph formed from the data provided
+        param method: Search algorithm for uncached routes, one of METHODS
+        param route_cache_size: Number of routes kept in the LRU cache
+        param tree_cache_size: Number of shortest path trees kept in the LRU cache
+        """
+        self.g = g
+        self.method = method
+        self.route_cache_size = route_cache_size
+        self.tree_cache_size = tree_cache_size
+        self.routes = OrderedDict()
+        self.trees = OrderedDict()
+        self.origin_queries = Counter()
+
+    def route(self, city_1: str, city_2: str):
+        """
+        Find the shortest path between two cities, using the caches.
+        param city_1: Start city
+        param city_2: Destination city
+        return: Tuple of the distance and the list of cities on the path, or
+                (inf, []) if no path exists
+        """
+        key = (city_1, city_2)
+        if key in self.routes:
+            self.routes.move_to_end(key)
+            return self.routes[key]
+
+        tree = self.trees.get(city_1)
+        if tree is None:
+            self.origin_queries[city_1] += 1
+            if self.origin_queries[city_1] >= HOT_ORIGIN_QUERIES:
+                tree = shortest_path_tree(self.g, self.g.index[city_1])
+                self.trees[city_1] = tree
+                if len(self.trees) > self.tree_cache_size:
+                    self.trees.popitem(last=False)
+
+        if tree is not None:
+            self.trees.move_to_end(city_1)
+            distances, previous_vertex = tree
+            node_2 = self.g.index[city_2]
+            if node_2 in distances:
+                result = (distances[node_2],
+                          [self.g.names[node] for node in build_path(previous_vertex, node_2)])
+            else:
+                result = (float('inf'), [])
+        else:
+            result = find_route(self.g, city_1, city_2, self.method)
+
+        self.routes[key] = result
+        if len(self.routes) > self.route_cache_size:
+            self.routes.popitem(last=False)
+
+        return result
+
+    def answer(self, request):
+        """
+        Answer one query.
+        param request: Dictionary with the "from", "to" and optional "format" keys
+        return: Dictionary to send back
+        """
+        try:
+            city_1, city_2 = request['from'], request['to']
+            output_format = request.get('format', 'cities')
+        except (KeyError, TypeError, AttributeError):
+            return {'ok': False, 'error': 'A query needs "from" and "to" cities'}
+
+        if not all(isinstance(value, str) for value in (city_1, city_2, output_format)):
+            return {'ok': False, 'error': 'The cities and the format must be strings'}
+        for city in (city_1, city_2):
+            if city not in self.g.index:
+                return {'ok': False, 'error': '{} is not a connected city in Europe'.format(city)}
+        if output_format not in ('cities', 'url'):
+            return {'ok': False, 'error': 'The format must be "cities" or "url"'}
+
+        distance, path = self.route(city_1, city_2)
+        if not path:
+            return {'ok': False,
+                    'error': 'No path exists between {} and {}'.format(city_1, city_2)}
+
+        if output_format == 'url':
+            output = maps_url(self.g, path)
+        else:
+            output = '\n'.join(path)
+
+        return {'ok': True, 'distance': distance, 'output': output}
+
+    def answer_line(self, line):
+        """
+        Answer one line of JSON.
+        param line: Query, as bytes
+        return: Answer, as a line of bytes
+        """
+        try:
+            request = json.loads(line)
+        except (ValueError, RecursionError):
+            response = {'ok': False, 'error': 'A query must be a JSON object'}
+        else:
+            try:
+                response = self.answer(request)
+            except Exception as error:
+                # One bad query must not take down the server or the client
+                response = {'ok': False, 'error': 'The query failed: {!r}'.format(error)}
+
+        return json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n'
+
+    async def handle(self, reader, writer):
+        """
+        Answer the queries of one client, until it disconnects.
+        param reader: asyncio.StreamReader of the client
+        param writer: asyncio.StreamWriter of the client
+        return: None
+        """
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # The line was longer than the reader's limit, and was
+                    # discarded
+                    writer.write(json.dumps({'ok': False, 'error': 'The query is too long'})
+                                 .encode('utf-8') + b'\n')
+                    await writer.drain()
+                    continue
+                if not line:
+                    break
+                if line.strip():
+                    writer.write(self.answer_line(line))
+                    await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve_unix(self, path):
+        """
+        Serve clients on a Unix socket, concurrently, forever.
+        param path: Socket path
+        return: None
+        """
+        server = await asyncio.start_unix_server(self.handle, path)
+        async with server:
+            await server.serve_forever()
 
-    for city in cities:
-        city = city.rstrip()
-        index, city_name = city.split('\t')
-        city_list.append(city_name)
+    async def serve_stdio(self):
+        """
+        Serve queries read from stdin, answering on stdout, until end of input.
+        Lines are read in a worker thread rather than through a pipe
+        transport, so that stdin can also be redirected from a file.
+        return: None
+        """
+        while True:
+            line = await asyncio.to_thread(sys.stdin.buffer.readline)
+            if not line:
+                break
+            if line.strip():
+                sys.stdout.buffer.write(self.answer_line(line))
+                sys.stdout.buffer.flush()
+
+
+def load_network(data_dir=DATA_DIR):
+    """
+    Read the cities, their locations and the connections between them, and
+    build the graph. Edges go both ways, weighted by the distance between
+    the cities.
+    param data_dir: Directory holding the three data files
+    return: CSRGraph of the network
+    """
+    # Create a list of all the cities. Each city's id is its line number,
+    # counting from 0.
+    city_list = []
+    with open(os.path.join(data_dir, 'vertex_names.txt'), 'r') as fh:
+        for line in fh:
+            _, city_name = line.rstrip().split('\t')
+            city_list.append(city_name)
 
     # Read the latitudes and longitudes for each city, save it as a tuple.
-    # Create a dictionary, with the name as key, and the tuple as value.
-    with open('/srv/datasets/e-roads/vertex_locations.txt', 'r') as fh:
-        locations = fh.readlines()
-
-    city_location = dict()
-    for line in locations:
-        line = line.rstrip()
-        idx, latitude, longitude = line.split(' ')
-        idx = int(idx)
-        latitude = float(latitude)
-        longitude = float(longitude)
-        coordinate = (latitude, longitude)
-        city_location[city_list[idx]] = coordinate
-
-    # Find all the cities connected to each other, and make a graph for them.
-    with open('/srv/datasets/e-roads/network.txt', 'r') as fh:
-        edges = fh.readlines()
-
-    city_network_graph = Graph()
-    for entry in edges:
-        entry = entry.rstrip()
-        city_idx_1 = int(entry.split(' ')[0])
-        city_idx_2 = int(entry.split(' ')[1])
-        city_1 = city_list[city_idx_1]
-        city_2 = city_list[city_idx_2]
-
-        # Get the latitudes and longitudes for the two cities
-        city_1_pos = city_location[city_1]
-        city_2_pos = city_location[city_2]
-
-        # Calculate the distance between them using the haversine formula
-        distance = haversine(city_1_pos, city_2_pos)
-
-        # Assign the distance between them as a weight for their edge
-        city_network_graph[city_1][city_2] = distance
-        city_network_graph[city_2][city_1] = distance
-
-    city_1 = sys.argv[1]
-    city_2 = sys.argv[2]
-
-    if city_1 not in city_list:
-        print(city_1, 'is not a connected city in Europe', file=sys.stderr)
+    city_location = [None] * len(city_list)
+    with open(os.path.join(data_dir, 'vertex_locations.txt'), 'r') as fh:
+        for line in fh:
+            idx, latitude, longitude = line.split()
+            city_location[int(idx) - 1] = (float(latitude), float(longitude))
+
+    # Find all the cities connected to each other
+    ends_1, ends_2 = array('l'), array('l')
+    with open(os.path.join(data_dir, 'network.txt'), 'r') as fh:
+        for line in fh:
+            city_idx_1, city_idx_2 = line.split()
+            ends_1.append(int(city_idx_1) - 1)
+            ends_2.append(int(city_idx_2) - 1)
+
+    for city_idx in set(ends_1) | set(ends_2):
+        if city_location[city_idx] is None:
+            raise ValueError('{} has no location, but is connected to other cities'.format(
+                city_list[city_idx]))
+
+    # Weigh the edges with the distance between the cities, using the
+    # haversine formula on all of them at once
+    weights = array('d')
+    np = import_numpy()
+    if np is not None:
+        latitudes = np.array([location[0] if location else np.nan for location in city_location])
+        longitudes = np.array([location[1] if location else np.nan for location in city_location])
+        ends_1_ids, ends_2_ids = np.asarray(ends_1), np.asarray(ends_2)
+        weights.frombytes(haversine_many(latitudes[ends_1_ids], longitudes[ends_1_ids],
+                                         latitudes[ends_2_ids], longitudes[ends_2_ids]).tobytes())
+    else:
+        weights.extend(haversine(city_location[city_1], city_location[city_2])
+                       for city_1, city_2 in zip(ends_1, ends_2))
+
+    # Edges go both ways
+    return CSRGraph(city_list, city_location, ends_1 + ends_2, ends_2 + ends_1, weights + weights)
+
+
+def data_fingerprint(data_dir=DATA_DIR):
+    """
+    Identify the current version of the data files by their sizes and
+    modification times, which is much cheaper than hashing them.
+    param data_dir: Directory holding the three data files
+    return: Tuple of 6 integers
+    """
+    fingerprint = ()
+    for name in DATA_FILES:
+        st = os.stat(os.path.join(data_dir, name))
+        fingerprint += (st.st_size, st.st_mtime_ns)
+
+    return fingerprint
+
+
+def write_cache_file(path, chunks):
+    """
+    Write a cache file under a temporary name and rename it into place, so
+    that readers never see it partially written.
+    param path: Cache file
+    param chunks: Iterable of bytes-like objects to write
+    return: None
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            for chunk in chunks:
+                fh.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def map_cache_file(path, header, magic, fingerprint=None):
+    """
+    Memory-map a cache file, and check its header. Headers start with the
+    magic string and the data_fingerprint() of the data files.
+    param path: Cache file
+    param header: struct.Struct of the header
+    param magic: Expected magic string
+    param fingerprint: If given, the expected data_fingerprint()
+    return: Tuple of the rest of the header fields and a memoryview of the
+            whole file, or None if the file is missing, stale or not a cache
+    """
+    try:
+        with open(path, 'rb') as fh:
+            mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    if len(mm) < header.size:
+        return None
+    fields = header.unpack_from(mm, 0)
+    if fields[0] != magic:
+        return None
+    if fingerprint is not None and tuple(fields[1:7]) != tuple(fingerprint):
+        return None
+
+    return fields[7:], memoryview(mm)
+
+
+def cache_sections(view, start, layout):
+    """
+    Cut consecutive typed arrays out of a mapped cache file, without copying.
+    param view: memoryview of the file
+    param start: Offset of the first array
+    param layout: Tuple of (typecode, length) pairs
+    return: List of memoryviews, or None if the arrays do not exactly fill
+            the rest of the file, as in a truncated or corrupt cache
+    """
+    if any(length < 0 for _, length in layout) or len(view) != start + sum(
+            length * struct.calcsize(typecode) for typecode, length in layout):
+        return None
+
+    sections = []
+    for typecode, length in layout:
+        size = length * struct.calcsize(typecode)
+        sections.append(view[start:start + size].cast(typecode))
+        start += size
+
+    return sections
+
+
+def save_graph(g: CSRGraph, path, fingerprint):
+    """
+    Write a graph to the binary cache format.
+    param g: CSRGraph to save
+    param path: Cache file
+    param fingerprint: data_fingerprint() of the files the graph was built from
+    return: None
+    """
+    names = '\n'.join(g.names).encode('utf-8')
+    locations = [location or (float('nan'), float('nan')) for location in g.locations]
+
+    write_cache_file(path, (
+        GRAPH_CACHE_HEADER.pack(GRAPH_CACHE_MAGIC, *fingerprint, len(g.names),
+                                len(g.targets), len(names)),
+        array('q', g.offsets), array('q', g.targets), array('d', g.weights),
+        array('d', (lat for lat, _ in locations)),
+        array('d', (lon for _, lon in locations)),
+        names))
+
+
+def open_graph(path, fingerprint=None):
+    """
+    Memory-map a graph saved by save_graph(). The arrays are used in place;
+    only the names and locations are turned into Python objects.
+    param path: Cache file
+    param fingerprint: If given, the cache is rejected unless it was built
+                       from data files with this data_fingerprint()
+    return: CSRGraph, or None if the file is missing, stale, truncated or
+            not a cache
+    """
+    mapped = map_cache_file(path, GRAPH_CACHE_HEADER, GRAPH_CACHE_MAGIC, fingerprint)
+    if mapped is None:
+        return None
+    (num_vertices, num_edges, names_size), view = mapped
+
+    sections = cache_sections(view, GRAPH_CACHE_HEADER.size, (
+        ('q', num_vertices + 1), ('q', num_edges), ('d', num_edges),
+        ('d', num_vertices), ('d', num_vertices), ('B', names_size)))
+    if sections is None:
+        return None
+    offsets, targets, weights, lats, lons, names = sections
+    try:
+        names = bytes(names).decode('utf-8').split('\n') if num_vertices else []
+    except UnicodeDecodeError:
+        return None
+    if len(names) != num_vertices:
+        return None
+
+    # A missing location is stored as NaN, which is not equal to itself
+    locations = [(lat, lon) if lat == lat else None for lat, lon in zip(lats, lons)]
+
+    return CSRGraph.from_arrays(names, locations, offsets, targets, weights)
+
+
+def load_graph(data_dir=DATA_DIR, cache_path=GRAPH_CACHE, hierarchy=False):
+    """
+    Load the graph from the compiled cache, if it is up to date with the
+    data files. Otherwise build it from the data files and refresh the cache.
+    The contraction hierarchy is cached the same way, in cache_path + '.ch'.
+    param data_dir: Directory holding the three data files
+    param cache_path: Cache file, or None to always read the data files
+    param hierarchy: Also load (or build) the graph's ContractionHierarchy
+    return: CSRGraph of the network
+    """
+    if cache_path is None:
+        g = load_network(data_dir)
+        if hierarchy:
+            g.hierarchy = ContractionHierarchy.build(g)
+        return g
+
+    fingerprint = data_fingerprint(data_dir)
+    g = open_graph(cache_path, fingerprint)
+    if g is None:
+        g = load_network(data_dir)
+        try:
+            save_graph(g, cache_path, fingerprint)
+        except OSError:
+            pass  # The cache is an optimization; run without it
+
+    if hierarchy:
+        g.hierarchy = ContractionHierarchy.open(cache_path + '.ch', fingerprint)
+        if g.hierarchy is None:
+            g.hierarchy = ContractionHierarchy.build(g)
+            try:
+                g.hierarchy.save(cache_path + '.ch', fingerprint)
+            except OSError:
+                pass
+
+    return g
+
+
+def self_test(seed=30, num_vertices=300, num_pairs=500):
+    """
+    Check that the contraction hierarchy finds the same routes as Dijkstra's
+    algorithm, between random pairs of vertices of random directed graphs:
+    one with integer weights, which must give exactly the same distances,
+    and one with fractional weights. The graphs have parallel edges and
+    loops, and are sparse enough to leave some pairs unconnected.
+    param seed: Seed of the random graphs and pairs
+    param num_vertices: Number of vertices of each graph
+    param num_pairs: Number of pairs compared on each graph
+    return: None
+    """
+    rng = random.Random(seed)
+    for random_weight in (lambda: rng.randint(1, 20), lambda: rng.uniform(0.1, 100)):
+        num_edges = 2 * num_vertices
+        sources = [rng.randrange(num_vertices) for _ in range(num_edges)]
+        targets = [rng.randrange(num_vertices) for _ in range(num_edges)]
+        weights = [random_weight() for _ in range(num_edges)]
+        g = CSRGraph([str(vertex) for vertex in range(num_vertices)], None,
+                     sources, targets, weights)
+        hierarchy = ContractionHierarchy.build(g)
+
+        for _ in range(num_pairs):
+            node_1, node_2 = rng.randrange(num_vertices), rng.randrange(num_vertices)
+            expected, _ = dijkstra(g, node_1, node_2)
+            distance, path = hierarchy.query(node_1, node_2)
+            if expected == float('inf'):
+                assert (distance, path) == (expected, []), (node_1, node_2)
+                continue
+            assert math.isclose(distance, expected, rel_tol=1e-12), (node_1, node_2)
+            assert path[0] == node_1 and path[-1] == node_2, (node_1, node_2)
+            assert path_length(g, path) == distance, (node_1, node_2)
+            if isinstance(weights[0], int):
+                assert distance == expected, (node_1, node_2)
+
+
+def usage():
+    """
+    Print the usage message and exit
+    return: None
+    """
+    print('Usage: cse30_e_roads.py [--method=' + '|'.join(METHODS) + '] [--stats] '
+          'city_1 city_2 [url]', file=sys.stderr)
+    print('       cse30_e_roads.py [--method=...] --serve[=socket_path]', file=sys.stderr)
+    print('       cse30_e_roads.py --build-cache', file=sys.stderr)
+    print('       cse30_e_roads.py --self-test', file=sys.stderr)
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    search_method = METHODS[0]
+    print_stats = False
+    serve = None
+    if args == ['--build-cache']:
+        city_network_graph = load_network()
+        save_graph(city_network_graph, GRAPH_CACHE, data_fingerprint())
+        ContractionHierarchy.build(city_network_graph).save(GRAPH_CACHE + '.ch',
+                                                             data_fingerprint())
+        sys.exit(0)
+    if args == ['--self-test']:
+        self_test()
+        sys.exit(0)
+    while args and args[0].startswith('--'):
+        option = args.pop(0)
+        if option == '--stats':
+            print_stats = True
+        elif option.startswith('--method=') and option[len('--method='):] in METHODS:
+            search_method = option[len('--method='):]
+        elif option == '--serve' or option.startswith('--serve='):
+            serve = option[len('--serve='):]
+        else:
+            usage()
+    if len(args) not in ((0,) if serve is not None else (2, 3)):
+        usage()
+
+    city_network_graph = load_graph(hierarchy=search_method == 'ch')
+
+    if serve is not None:
+        route_server = RouteServer(city_network_graph, search_method)
+        try:
+            if serve:
+                asyncio.run(route_server.serve_unix(serve))
+            else:
+                asyncio.run(route_server.serve_stdio())
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    city_1 = parse_city(city_network_graph, args[0])
+    city_2 = parse_city(city_network_graph, args[1])
+
+    if city_1 is None:
+        print(args[0], 'is not a connected city in Europe', file=sys.stderr)
         sys.exit(1)
 
-    if city_2 not in city_list:
-        print(city_2, 'is not a connected city in Europe', file=sys.stderr)
+    if city_2 is None:
+        print(args[1], 'is not a connected city in Europe', file=sys.stderr)
         sys.exit(1)
 
     if city_1 == city_2:
-        if len(sys.argv) == 3:
+        if len(args) == 2:
             print(city_1)
         else:
-            URL = 'https://www.google.com/maps/dir/'
-            (latitude, longitude) = city_location[city_1]
-            URL += '{:0.3f}'.format(latitude) + ',' + '{:0.3f}'.format(longitude) + '/'
-            print(URL)
+            print(maps_url(city_network_graph, [city_1]))
     else:
-        shortest_path(city_network_graph, city_1, city_2, len(sys.argv) - 1)
+        shortest_path(city_network_graph, city_1, city_2, len(args), search_method, print_stats)
@@ -9,11 +9,470 @@ horizontal, vertical, and diagonal directions. Since for each dimension,
 we can go front or back, there are a total of 8 directions to be
 searched.
 
-Strings of length >= the specified lengths are constructed, and then
-searched in the dictionary using binary search. Valid words are returned
-in a sorted order.
+By default the dictionary is loaded into a trie, and the grid is walked
+from every cell in every direction, abandoning a walk as soon as no
+dictionary word starts with the letters seen so far. Valid words are
+returned in a sorted order. Options, given before the parameters:
+--method=trie|aho-corasick|substrings
+                            Pick the search engine. 'aho-corasick' streams
+                            each line of the grid through an Aho-Corasick
+                            automaton built from the trie, in time linear in
+                            the grid size plus the matches. 'substrings'
+                            constructs every string of length >= the
+                            specified length, and searches it in the
+                            dictionary using binary search
+--batch[=directory]         Search many grids with the dictionary loaded once,
+                            spread over a pool of worker processes. The grids
+                            are read from stdin, separated by blank lines, or
+                            one per file from the directory, in the order of
+                            the file names. The words found in each grid are
+                            printed in the same order, followed by a blank
+                            line.
+--workers=n                 Number of batch worker processes, all CPUs by
+                            default
+
+The trie is compiled once per dictionary, and kept in the directory named by
+$WORD_SEARCH_CACHE (default ~/.cache/cse30_word_search), under the SHA-256
+hash of the dictionary file. Later runs memory-map it instead of reading
+and sorting the dictionary again.
 """
+from array import array
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import hashlib
+import mmap
+import multiprocessing
+import os
+import struct
 import sys
+import tempfile
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; pure Python fallbacks are used without it
+    np = None
+
+# Search engines; the first is the default
+METHODS = ('trie', 'aho-corasick', 'substrings')
+
+# Compiled dictionaries. Each file is named after the hash of its dictionary
+# file. It starts with the magic string and the number of trie nodes, and is
+# followed by the offsets, the terminal flags, and the labels in UTF-32.
+DICT_CACHE_DIR = os.environ.get('WORD_SEARCH_CACHE') or \
+    os.path.expanduser('~/.cache/cse30_word_search')
+DICT_CACHE_MAGIC = b'WORDTRI1'
+DICT_CACHE_HEADER = struct.Struct('<8sq')
+
+# Number of grids handed to a batch worker process at a time
+BATCH_CHUNK_SIZE = 16
+
+# Search engine used by the search_many() worker processes
+_worker_engine = None
+
+
+class Trie:
+    """
+    A compact trie of the dictionary words. The nodes are numbered in
+    breadth first order, so the children of each node are numbered
+    consecutively: the children of node v are the nodes offsets[v] to
+    offsets[v + 1] - 1, and labels[c] is the letter on the edge into node c.
+    Finding a child is then a single str.find() over the labels of the
+    children. Node 0 is the root, and terminal[v] is 1 if the letters on
+    the way to node v spell a word.
+    """
+
+    def __init__(self, labels, offsets, terminal):
+        """
+        param labels: String of the letter on the edge into each node
+        param offsets: Array of the first child of each node, followed by
+                       the number of nodes
+        param terminal: Bytes with 1 for the nodes that end a word
+        """
+        self.labels = labels
+        self.offsets = offsets
+        self.terminal = terminal
+
+    @classmethod
+    def build(cls, words):
+        """
+        Build the trie of the words. Each node stands for the range of the
+        sorted words that start with its letters, so its children are found
+        by binary searching for where each next letter ends.
+        param words: Sorted list of unique words
+        return: The Trie
+        """
+        # The root has no edge into it, so its label is only a placeholder
+        labels = [' ']
+        offsets = array('l', [1])
+        terminal = bytearray([0])
+        ranges = deque([(0, len(words), 0)])
+
+        while ranges:
+            low, high, depth = ranges.popleft()
+            if low < high and len(words[low]) == depth:
+                low += 1
+            while low < high:
+                letter = words[low][depth]
+                end = bisect_left(words, words[low][:depth] + chr(ord(letter) + 1), low, high)
+                labels.append(letter)
+                terminal.append(len(words[low]) == depth + 1)
+                ranges.append((low, end, depth + 1))
+                low = end
+            offsets.append(len(labels))
+
+        return cls(''.join(labels), offsets, bytes(terminal))
+
+    def save(self, path):
+        """
+        Write the trie to a file that open() can map. The file is written
+        under a temporary name and renamed into place, so that readers never
+        see it partially written.
+        param path: Cache file
+        return: None
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(DICT_CACHE_HEADER.pack(DICT_CACHE_MAGIC, len(self.labels)))
+                fh.write(array('q', self.offsets))
+                fh.write(self.terminal)
+                fh.write(self.labels.encode('utf-32-le'))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def open(cls, path):
+        """
+        Memory-map a trie written by save(). The offsets and terminal flags
+        are used in place, so processes searching with the same dictionary
+        share their pages; only the labels are decoded into a string.
+        param path: Cache file
+        return: The Trie, or None if the file is missing or not a cache
+        """
+        try:
+            with open(path, 'rb') as fh:
+                mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+        if len(mm) < DICT_CACHE_HEADER.size:
+            return None
+        magic, num_nodes = DICT_CACHE_HEADER.unpack_from(mm, 0)
+        start = DICT_CACHE_HEADER.size
+        terminal_start = start + 8 * (num_nodes + 1)
+        labels_start = terminal_start + num_nodes
+        if magic != DICT_CACHE_MAGIC or len(mm) != labels_start + 4 * num_nodes:
+            return None
+
+        view = memoryview(mm)
+        return cls(bytes(view[labels_start:]).decode('utf-32-le'),
+                   view[start:terminal_start].cast('q'), view[terminal_start:labels_start])
+
+    def find_words(self, lines, min_len):
+        """
+        Walk each line from every position, following the trie until the
+        letters read are no longer the start of a word
+        param lines: Iterable of strings to search, each in one direction
+        param min_len: Minimum length of the words to be returned
+        return: Set of the words of length >= min_len found in the lines
+        """
+        labels, offsets, terminal = self.labels, self.offsets, self.terminal
+        words_found = set()
+
+        for line in lines:
+            for start in range(len(line) - min_len + 1):
+                node = 0
+                for end in range(start, len(line)):
+                    node = labels.find(line[end], offsets[node], offsets[node + 1])
+                    if node < 0:
+                        break
+                    if terminal[node] and end - start + 1 >= min_len:
+                        words_found.add(line[start:end + 1])
+
+        return words_found
+
+
+class AhoCorasick:
+    """
+    An Aho-Corasick automaton over a Trie, which finds every word in a line
+    in one pass. After reading some letters, the automaton is at the node of
+    the longest suffix of them that is in the trie. When the next letter has
+    no edge, it falls back along fail[v], the node of the longest proper
+    suffix of node v's letters. The words ending at a position are the node,
+    if it is terminal, and the chain of output[v], the node of the longest
+    proper suffix of node v's letters that is a word (0 if there is none).
+    """
+
+    def __init__(self, trie):
+        """
+        Add the fail and output links to a trie. The nodes are in breadth
+        first order, so the links of shallower nodes are always ready.
+        param trie: Trie of the dictionary
+        """
+        labels, offsets, terminal = trie.labels, trie.offsets, trie.terminal
+        num_nodes = len(labels)
+        fail = array('l', [0]) * num_nodes
+        output = array('l', [0]) * num_nodes
+        depth = array('l', [0]) * num_nodes
+
+        for parent in range(num_nodes):
+            for node in range(offsets[parent], offsets[parent + 1]):
+                depth[node] = depth[parent] + 1
+                if parent:
+                    suffix = fail[parent]
+                    while True:
+                        next_node = labels.find(labels[node], offsets[suffix], offsets[suffix + 1])
+                        if next_node >= 0 or not suffix:
+                            fail[node] = max(next_node, 0)
+                            break
+                        suffix = fail[suffix]
+                suffix = fail[node]
+                output[node] = suffix if terminal[suffix] else output[suffix]
+
+        self.trie = trie
+        self.fail = fail
+        self.output = output
+        self.depth = depth
+
+    def find_words(self, lines, min_len):
+        """
+        Stream each line through the automaton
+        param lines: Iterable of strings to search, each in one direction
+        param min_len: Minimum length of the words to be returned
+        return: Set of the words of length >= min_len found in the lines
+        """
+        labels, offsets, terminal = self.trie.labels, self.trie.offsets, self.trie.terminal
+        fail, output, depth = self.fail, self.output, self.depth
+        words_found = set()
+
+        for line in lines:
+            node = 0
+            for end, letter in enumerate(line, 1):
+                while True:
+                    next_node = labels.find(letter, offsets[node], offsets[node + 1])
+                    if next_node >= 0 or not node:
+                        node = max(next_node, 0)
+                        break
+                    node = fail[node]
+                word_node = node if terminal[node] else output[node]
+                while word_node:
+                    if depth[word_node] >= min_len:
+                        words_found.add(line[end - depth[word_node]:end])
+                    word_node = output[word_node]
+
+        return words_found
+
+
+def load_dictionary(dict_file):
+    """
+    Read the dictionary file, one word per line
+    param dict_file: Path of the dictionary file
+    return: Sorted list of the unique words, in upper case
+    """
+    with open(dict_file, 'r') as fh:
+        return sorted({word.upper().strip() for word in fh} - {''})
+
+
+def dictionary_hash(dict_file):
+    """
+    Hash the contents of the dictionary file
+    param dict_file: Path of the dictionary file
+    return: SHA-256 hash as a hex string
+    """
+    digest = hashlib.sha256()
+    with open(dict_file, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def load_trie(dict_file, cache_dir=DICT_CACHE_DIR):
+    """
+    Load the trie of a dictionary from its compiled copy in the cache
+    directory, compiling it first if there is none. A cache that cannot be
+    written is not an error; the trie is then rebuilt on every run.
+    param dict_file: Path of the dictionary file
+    param cache_dir: Directory of the compiled dictionaries, or None to
+                     always build the trie from the dictionary file
+    return: The Trie
+    """
+    if cache_dir is None:
+        return Trie.build(load_dictionary(dict_file))
+
+    cache_path = os.path.join(cache_dir, dictionary_hash(dict_file) + '.trie')
+    trie = Trie.open(cache_path)
+    if trie is None:
+        trie = Trie.build(load_dictionary(dict_file))
+        try:
+            trie.save(cache_path)
+        except OSError:
+            pass
+
+    return trie
+
+
+def grid_lines(grid):
+    """
+    Return every line of the grid that a word can lie on: the rows, the
+    columns, the diagonals going right and the diagonals going left, each
+    read in both directions
+    param grid: Input grid, as a list of rows of letters
+    return: List of the lines as strings
+    """
+    rows = [''.join(row) for row in grid]
+    num_rows = len(rows)
+    num_cols = len(rows[0]) if rows else 0
+
+    if np is not None and num_cols:
+        lines = rows + array_lines(grid_array(rows))
+    else:
+        lines = rows + [''.join(column) for column in zip(*rows)]
+        # Cells on a diagonal going right have the same row - column, and
+        # cells on a diagonal going left have the same row + column
+        for diff in range(1 - num_cols, num_rows):
+            lines.append(''.join(rows[i][i - diff]
+                                 for i in range(max(diff, 0), min(num_rows, num_cols + diff))))
+        for total in range(num_rows + num_cols - 1):
+            lines.append(''.join(rows[i][total - i] for i in
+                                 range(max(total - num_cols + 1, 0), min(num_rows, total + 1))))
+
+    return lines + [line[::-1] for line in lines]
+
+
+def grid_array(rows):
+    """
+    Turn the grid into a NumPy array of the letters' code points, decoded
+    from the grid's text in one step
+    param rows: List of the rows as strings, all of the same length
+    return: 2D NumPy array of uint32
+    """
+    text = ''.join(rows).encode('utf-32-le')
+    return np.frombuffer(text, dtype='<u4').reshape(len(rows), len(rows[0]))
+
+
+def array_lines(cells):
+    """
+    Extract the columns, the diagonals going right and the diagonals going
+    left of a grid. The diagonals are strided views of the array (of its
+    mirror image, for the diagonals going left), so they are all gathered
+    into one buffer, and decoded into a single string that is then cut into
+    the lines.
+    param cells: 2D NumPy array of code points, from grid_array()
+    return: List of the lines as strings
+    """
+    num_rows, num_cols = cells.shape
+    mirrored = cells[:, ::-1]
+
+    parts = [cells.T.ravel()]
+    lengths = [num_rows] * num_cols
+    for offset in range(1 - num_rows, num_cols):
+        parts.append(cells.diagonal(offset))
+        parts.append(mirrored.diagonal(offset))
+        lengths += [len(parts[-1])] * 2
+
+    text = np.concatenate(parts).tobytes().decode('utf-32-le')
+    lines = []
+    start = 0
+    for length in lengths:
+        lines.append(text[start:start + length])
+        start += length
+
+    return lines
+
+
+def search_grid(engine, grid, min_len):
+    """
+    Find the dictionary words in a grid
+    param engine: Trie or AhoCorasick of the dictionary
+    param grid: Input grid, as a list of rows of letters
+    param min_len: Minimum length of the words to be returned
+    return: Sorted list of the unique words found
+    """
+    return sorted(engine.find_words(grid_lines(grid), max(min_len, 1)))
+
+
+def read_grids(fh):
+    """
+    Read grids separated by blank lines
+    param fh: File to read
+    return: Generator of the grids, as lists of rows of letters
+    """
+    grid = []
+    for line in fh:
+        if line.strip():
+            grid.append(list(line.strip()))
+        elif grid:
+            yield grid
+            grid = []
+    if grid:
+        yield grid
+
+
+def read_grid_directory(directory):
+    """
+    Read one grid from each file of a directory, in the order of the names
+    param directory: Directory of grid files
+    return: Generator of the grids, as lists of rows of letters
+    """
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), 'r') as fh:
+            yield [list(line.strip()) for line in fh if line.strip()]
+
+
+def _search_grids_task(grids, min_len):
+    """
+    Search a chunk of grids in a worker process.
+    """
+    return [search_grid(_worker_engine, grid, min_len) for grid in grids]
+
+
+def search_many(engine, grids, min_len, workers=None):
+    """
+    Find the dictionary words in each of many grids. The grids are spread,
+    in chunks of BATCH_CHUNK_SIZE, over a pool of forked worker processes,
+    which share the parent's copy of the engine; with a memory-mapped trie
+    (see load_trie()), its pages are not even copied. Only a couple of
+    chunks per worker are in flight at any time, so the grids are read as
+    the results are consumed.
+    param engine: Trie or AhoCorasick of the dictionary
+    param grids: Iterable of grids, as lists of rows of letters
+    param min_len: Minimum length of the words to be returned
+    param workers: Number of worker processes, all CPUs by default
+    return: Generator of the sorted lists of unique words found, one per
+            grid, in the order of the grids
+    """
+    global _worker_engine
+
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1:
+        for grid in grids:
+            yield search_grid(engine, grid, min_len)
+        return
+
+    grids = iter(grids)
+    chunks = iter(lambda: list(islice(grids, BATCH_CHUNK_SIZE)), [])
+
+    _worker_engine = engine
+    executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'))
+    try:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_search_grids_task, chunk, min_len))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+        _worker_engine = None
 
 
 def search_in_dictionary(word_to_check, low, high):
@@ -41,204 +500,177 @@ def search_in_dictionary(word_to_check, low, high):
 
 def create_slices(arr, slice_length):
     """
-    Given an array arr and a slice length, construct a list of contiguous elements from
-    the array of size >= slice length, in both the forward and reversed orders. For
+    Given an array arr and a slice length, generate the strings of contiguous elements
+    from the array of size >= slice length, in both the forward and reversed orders. For
     example, given an array [1, 2, 3, 4], and a slice length of 2, the function should
-    generate the lists ([1, 2], [1, 2, 3], [1, 2, 3, 4], [2, 3], [2, 3, 4], [3, 4],
+    generate the strings of ([1, 2], [1, 2, 3], [1, 2, 3, 4], [2, 3], [2, 3, 4], [3, 4],
     [4, 3], [4, 3, 2], [4, 3, 2, 1], [3, 2], [3, 2, 1], [2, 1]).
-    The order of the lists is not important.
+    The order of the strings is not important.
     param arr: Input array to be sliced
     param slice_length: Minimum length of the slice to be used for array
-    return: List of sliced elements of the array
+    return: Generator of the sliced elements of the array, joined into strings
     """
-    return_list = []
-    arr_reversed = list(reversed(arr))
+    arr_reversed = arr[::-1]
 
     for i in range(len(arr) - slice_length + 1):
         for j in range(i + slice_length, len(arr) + 1):
-            return_list.append(''.join(arr[i:j]))
-            return_list.append(''.join(arr_reversed[i:j]))
-    return return_list
+            yield ''.join(arr[i:j])
+            yield ''.join(arr_reversed[i:j])
 
 
-def traverse_horizontal(grid, size, min_len):
+def diagonal(grid, row, col, row_step, col_step):
     """
-    For each row in the input grid, return contiguous words of length >= min_len
-    param grid: Input grid
-    param size: Number of rows/columns in the grid
-    param min_len: Minimum length of the words to be returned
-    return: List of all words of length >= min_len
+    Collect the elements of the grid along a diagonal, up to the edge of the grid
+    param grid: Input grid, as a list of rows of equal length
+    param row: Row of the first element
+    param col: Column of the first element
+    param row_step: 1 to go down, -1 to go up
+    param col_step: 1 to go right, -1 to go left
+    return: List of the elements
     """
-    return_list = []
-    for i in range(size):
-        revg = list(reversed(grid[i]))
-        for j in range(size):
-            for k in range(j + min_len, size + 1):
-                return_list.append(''.join(grid[i][j:k]))
-                return_list.append(''.join(revg[j:k]))
-
-    return return_list
+    elem = []
+    while 0 <= row < len(grid) and 0 <= col < len(grid[0]):
+        elem.append(grid[row][col])
+        row += row_step
+        col += col_step
+    return elem
 
 
-def traverse_vertical(grid, size, min_len):
+def traverse_horizontal(grid, min_len):
     """
-    For each column in the input grid, return contiguous words of length >= min_len
-    param grid: Input grid
-    param size: Number of rows/columns in the grid
+    For each row in the input grid, generate contiguous words of length >= min_len
+    param grid: Input grid, as a list of rows of equal length
     param min_len: Minimum length of the words to be returned
-    return: List of all words of length >= min_len
+    return: Generator of all words of length >= min_len
     """
-    return_list = []
-    cols = list(zip(*grid))
-    for i in range(size):
-        revc = list(reversed(cols[i]))
-        for j in range(size):
-            for k in range(j + min_len, size + 1):
-                return_list.append(''.join(cols[i][j:k]))
-                return_list.append(''.join(revc[j:k]))
+    for row in grid:
+        yield from create_slices(row, min_len)
+
 
-    return return_list
+def traverse_vertical(grid, min_len):
+    """
+    For each column in the input grid, generate contiguous words of length >= min_len
+    param grid: Input grid, as a list of rows of equal length
+    param min_len: Minimum length of the words to be returned
+    return: Generator of all words of length >= min_len
+    """
+    for column in zip(*grid):
+        yield from create_slices(column, min_len)
 
 
-def traverse_diag_left_from_top(grid, size, min_len):
+def traverse_diag_left_from_top(grid, min_len):
     """
-    For each diagonal going left in the input grid, return contiguous words
+    For each diagonal going left in the input grid, generate contiguous words
     of length >= min_len. The diagonal is scanned only from the top row,
     since we consider the order of the words in both directions
-    param grid: Input grid
-    param size: Number of rows/columns in the grid
+    param grid: Input grid, as a list of rows of equal length
     param min_len: Minimum length of the words to be returned
-    return: List of all words of length >= min_len
+    return: Generator of all words of length >= min_len
     """
-    elem = []
-    return_list = []
-    for i in range(min_len - 1, size):
-        k = i
-        for j in range(0, i + 1):
-            # Create a list of elements in the left diagonal
-            # row starting from an element in row 0
-            elem.append(grid[j][k])
-            k -= 1
-        for item in create_slices(elem, min_len):
-            return_list.append(item)
-        elem = []
-    return return_list
-
-
-def traverse_diag_right_from_top(grid, size, min_len):
-    """
-    For each diagonal going right in the input grid, return contiguous words
+    for col in range(len(grid[0]) if grid else 0):
+        yield from create_slices(diagonal(grid, 0, col, 1, -1), min_len)
+
+
+def traverse_diag_right_from_top(grid, min_len):
+    """
+    For each diagonal going right in the input grid, generate contiguous words
     of length >= min_len. The diagonal is scanned only from the top row,
     since we consider the order of the words in both directions
-    param grid: Input grid
-    param size: Number of rows/columns in the grid
+    param grid: Input grid, as a list of rows of equal length
     param min_len: Minimum length of the words to be returned
-    return: List of all words of length >= min_len
+    return: Generator of all words of length >= min_len
     """
-    elem = []
-    return_list = []
-    for i in range(size - min_len + 1):
-        k = i
-        for j in range(0, size - i):
-            # Create a list of elements in the right diagonal
-            # row starting from an element in row 0
-            elem.append(grid[j][k])
-            k += 1
-        for item in create_slices(elem, min_len):
-            return_list.append(item)
-        elem = []
-    return return_list
-
-
-def traverse_diag_left_from_bottom(grid, size, min_len):
-    """
-    For each diagonal going left in the input grid, return contiguous words
-    of length >= min_len. The diagonal is scanned only from the bottom row,
-    and only for the diagonals not covered by the top row diagonal scan functions.
-    param grid: Input grid
-    param size: Number of rows/columns in the grid
-    param min_len: Minimum length of the words to be returned
-    return: List of all words of length >= min_len
+    for col in range(len(grid[0]) if grid else 0):
+        yield from create_slices(diagonal(grid, 0, col, 1, 1), min_len)
+
+
+def traverse_diag_left_from_bottom(grid, min_len):
     """
-    elem = []
-    return_list = []
-    for i in range(min_len - 1, size - 1):
-        k = i
-        for j in range(size - 1, size - i - 2, -1):
-            # Create a list of elements in the left diagonal
-            # row starting from an element in row n - 1
-            elem.append(grid[j][k])
-            k -= 1
-        for item in create_slices(elem, min_len):
-            return_list.append(item)
-        elem = []
-    return return_list
-
-
-def traverse_diag_right_from_bottom(grid, size, min_len):
-    """
-    For each diagonal going right in the input grid, return contiguous words
-    of length >= min_len. The diagonal is scanned only from the bottom row,
-    and only for the diagonals not covered by the top row diagonal scan functions.
-    param grid: Input grid
-    param size: Number of rows/columns in the grid
+    For each diagonal going left in the input grid, generate contiguous words
+    of length >= min_len, only for the diagonals not covered by the top row
+    diagonal scan functions. These start in the last column below the top row.
+    param grid: Input grid, as a list of rows of equal length
     param min_len: Minimum length of the words to be returned
-    return: List of all words of length >= min_len
+    return: Generator of all words of length >= min_len
     """
-    elem = []
-    return_list = []
-    for i in range(1, size - min_len + 1):
-        k = i
-        for j in range(size - 1, i - 1, -1):
-            # Create a list of elements in the right diagonal
-            # row starting from an element in row n - 1
-            elem.append(grid[j][k])
-            k += 1
-        for item in create_slices(elem, min_len):
-            return_list.append(item)
-        elem = []
-    return return_list
-
+    for row in range(1, len(grid)):
+        yield from create_slices(diagonal(grid, row, len(grid[0]) - 1, 1, -1), min_len)
 
-if __name__ == '__main__':
-    min_length = int(sys.argv[1])
-    dict_file = sys.argv[2]
 
-    input_data = sys.stdin.readlines()
-    grid_size = len(input_data)
-
-    A = []
-    for line in input_data:
-        A.append(list(line.strip()))
-
-    words_to_search = list()
-    words_to_search.append(traverse_vertical(A, grid_size, min_length))
-    words_to_search.append(traverse_horizontal(A, grid_size, min_length))
-    words_to_search.append(traverse_diag_left_from_top(A, grid_size, min_length))
-    words_to_search.append(traverse_diag_right_from_top(A, grid_size, min_length))
-    words_to_search.append(traverse_diag_left_from_bottom(A, grid_size, min_length))
-    words_to_search.append(traverse_diag_right_from_bottom(A, grid_size, min_length))
-
-    unsorted_dict = []
-    with open(dict_file, 'r') as fh:
-        words = fh.readlines()
+def traverse_diag_right_from_bottom(grid, min_len):
+    """
+    For each diagonal going right in the input grid, generate contiguous words
+    of length >= min_len, only for the diagonals not covered by the top row
+    diagonal scan functions. These start in the first column below the top row.
+    param grid: Input grid, as a list of rows of equal length
+    param min_len: Minimum length of the words to be returned
+    return: Generator of all words of length >= min_len
+    """
+    for row in range(1, len(grid)):
+        yield from create_slices(diagonal(grid, row, 0, 1, 1), min_len)
 
-    for word in words:
-        unsorted_dict.append(word.upper().strip())
 
-    sorted_dict = sorted(unsorted_dict)
+def usage():
+    """
+    Print the usage message and exit
+    return: None
+    """
+    print('Usage: cse30_word_search.py [--method=' + '|'.join(METHODS) + '] '
+          'min_length dict_file < grid', file=sys.stderr)
+    print('       cse30_word_search.py [--method=...] --batch[=directory] [--workers=n] '
+          'min_length dict_file', file=sys.stderr)
+    sys.exit(1)
 
-    words_found = []
 
-    for word_list in words_to_search:
-        for word in word_list:
-            if search_in_dictionary(word, 0, len(sorted_dict)):
-                words_found.append(word)
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    search_method = METHODS[0]
+    batch = None
+    num_workers = None
+    while args and args[0].startswith('--'):
+        option = args.pop(0)
+        if option.startswith('--method=') and option[len('--method='):] in METHODS:
+            search_method = option[len('--method='):]
+        elif option == '--batch' or option.startswith('--batch='):
+            batch = option[len('--batch='):]
+        elif option.startswith('--workers=') and option[len('--workers='):].isdigit():
+            num_workers = int(option[len('--workers='):])
+        else:
+            usage()
+    if len(args) != 2 or (batch is not None and search_method == 'substrings'):
+        usage()
+
+    min_length = int(args[0])
+    dict_file = args[1]
+
+    if batch is not None:
+        trie = load_trie(dict_file)
+        engine = trie if search_method == 'trie' else AhoCorasick(trie)
+        grids = read_grid_directory(batch) if batch else read_grids(sys.stdin)
+        for unique_words in search_many(engine, grids, min_length, num_workers):
+            for word in unique_words:
+                print(word)
+            print()
+        sys.exit(0)
+
+    A = [list(line.strip()) for line in sys.stdin if line.strip()]
+
+    if search_method != 'substrings':
+        trie = load_trie(dict_file)
+        engine = trie if search_method == 'trie' else AhoCorasick(trie)
+        for word in search_grid(engine, A, min_length):
+            print(word)
+        sys.exit(0)
+
+    sorted_dict = load_dictionary(dict_file)
+
+    words_found = set()
+    for traversal in (traverse_vertical, traverse_horizontal,
+                      traverse_diag_left_from_top, traverse_diag_right_from_top,
+                      traverse_diag_left_from_bottom, traverse_diag_right_from_bottom):
+        for word in traversal(A, min_length):
+            if word not in words_found and search_in_dictionary(word, 0, len(sorted_dict) - 1):
+                words_found.add(word)
 
-    unique_words = []
     for word in sorted(words_found):
-        if word not in unique_words:
-            unique_words.append(word)
-
-    for word in unique_words:
         print(word)
@@ -13,8 +13,72 @@ generate information that might be of interest, e.g.
 
 from collections.abc import Callable, Iterator
 
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from typing import List
+import bisect
+import inspect
+import itertools
 import math
+import mmap
+import os
+import random
+import struct
+import tempfile
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; the batch helpers fall back to pure Python
+    np = None
+
+# Number of odd candidates sieved per segment of primes(). 32K entries keeps
+# the working bytearray inside a typical L1/L2 data cache.
+SEGMENT_SIZE = 1 << 15
+
+# Primes used to pre-filter candidates before running Miller-Rabin
+SMALL_PRIMES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47,
+                53, 59, 61, 67, 71, 73, 79, 83, 89, 97)
+
+# Testing against these witnesses makes Miller-Rabin exact for every n < 2^64
+MR_WITNESSES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37)
+
+# Extra random witnesses used above 2^64, where the test is probabilistic
+MR_EXTRA_ROUNDS = 16
+
+# Numbers below this limit are factored with a smallest-prime-factor table
+SPF_LIMIT = 1 << 20
+
+# Numbers handed to a worker of primes_in_range() at a time
+RANGE_CHUNK_SIZE = 1 << 24
+
+# Base primes of primes_in_range(), sent once to each worker process
+_worker_base_primes = []
+
+# Layout of the on-disk prime table: a header holding a magic string (which
+# carries the format version) and the limit covered, then one bit per odd
+# number below the limit, bit k of byte j standing for 16 * j + 2 * k + 1
+CACHE_MAGIC = b'PRIMEBM1'
+CACHE_HEADER = struct.Struct('<8sQ')
+
+# Initial and maximum limits of the on-disk prime table
+CACHE_LIMIT = 1 << 24
+CACHE_MAX_LIMIT = 1 << 32
+
+# Conversions between one byte per flag and the ASCII digits of a bit string
+_FLAG_TO_ASCII = bytes.maketrans(b'\x00\x01', b'01')
+_ASCII_TO_FLAG = bytes.maketrans(b'01', b'\x00\x01')
+
+# The prime table opened by enable_cache(), if any
+_prime_table = None
+
+# Translation tables for the prime-factor counts of semiprimes(): the first
+# adds one to every count (saturating at 3), the second keeps counts of one
+_OMEGA_INC = bytes(min(b + 1, 3) for b in range(256))
+_OMEGA_ONE = bytes(b == 1 for b in range(256))
+
+# The smallest-prime-factor table, built on first use and shared by all calls
+_spf_table = array('I')
 
 
 def elements_under(sequence: Iterator[int], bound: int, predicate: Callable[[int], bool] = None) \
@@ -27,6 +91,10 @@ def elements_under(sequence: Iterator[int], bound: int, predicate: Callable[[int
     :param predicate: if present, the sequence includes only values for which this function
      returns True
     """
+    if _prime_table is not None and _is_fresh_primes(sequence):
+        # primes() reads from the table, so make it cover the whole request
+        _prime_table.extend(bound)
+
     item = next(sequence)
 
     while item < bound:
@@ -38,72 +106,708 @@ def elements_under(sequence: Iterator[int], bound: int, predicate: Callable[[int
         item = next(sequence)
 
 
-def is_prime(n: int) -> bool:
-    """ Returns whether n is prime. """
-    for i in range(2, math.floor(math.sqrt(n)) + 1):
-        if n % i == 0:
+def _miller_rabin(n: int) -> bool:
+    """
+    Runs the Miller-Rabin test on an odd n that has no factor in SMALL_PRIMES.
+    The answer is exact for n < 2^64, and wrong with probability below
+    4^-MR_EXTRA_ROUNDS above that.
+    """
+    d = n - 1
+    s = 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+
+    witnesses = MR_WITNESSES
+    if n >= 1 << 64:
+        witnesses += tuple(random.randrange(2, n - 1) for _ in range(MR_EXTRA_ROUNDS))
+
+    for a in witnesses:
+        x = pow(a, d, n)
+        if x in (1, n - 1):
+            continue
+        for _ in range(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
             return False
 
     return True
 
 
+def is_prime(n: int) -> bool:
+    """ Returns whether n is prime. """
+    if n < 2:
+        return False
+
+    if _prime_table is not None and n < _prime_table.limit:
+        return n in _prime_table
+
+    for p in SMALL_PRIMES:
+        if n % p == 0:
+            return n == p
+
+    if n < SMALL_PRIMES[-1] ** 2:
+        return True
+
+    return _miller_rabin(n)
+
+
+def is_prime_many(values):
+    """
+    Tests a batch of integers for primality.
+
+    With NumPy available, the small-prime trial division runs vectorized over
+    the whole batch, and only the survivors go through Miller-Rabin one by one.
+
+    :param values: a list or NumPy array of integers
+    :return: a boolean mask, of the same kind as values (list or NumPy array)
+    """
+    if np is None:
+        return [is_prime(int(v)) for v in values]
+
+    arr = np.asarray(values)
+    if arr.dtype.kind not in 'iu':
+        # Python ints too large for a machine integer
+        mask = np.array([is_prime(int(v)) for v in arr.ravel()], dtype=bool).reshape(arr.shape)
+    else:
+        mask = arr >= 2
+        undecided = mask.copy()
+        for p in SMALL_PRIMES:
+            divisible = arr % p == 0
+            mask &= ~divisible | (arr == p)
+            undecided &= ~divisible
+        # Anything below the square of the largest small prime is now settled
+        undecided &= arr >= SMALL_PRIMES[-1] ** 2
+        for idx in np.flatnonzero(undecided):
+            mask.flat[idx] = _miller_rabin(int(arr.flat[idx]))
+
+    if isinstance(values, np.ndarray):
+        return mask
+    return mask.tolist()
+
+
 def nth_element(sequence: Iterator[int], n: int) -> int:
     """
     Returns the nth element of a possibly infinite sequence of integers.
 
+    A fresh primes() generator is answered directly by nth_prime(), without
+    iterating; the generator is then left unconsumed.
+
     :param sequence: a sequence of integers, e.g. primes()
     :param n: the sequence index desired
     :return: the value at index n of the sequence
     """
+    if _is_fresh_primes(sequence):
+        return nth_prime(n)
+
     for _ in range(n):
         next(sequence)
 
     return next(sequence)
 
 
+def _is_fresh_primes(sequence: Iterator[int]) -> bool:
+    """ Returns whether sequence is a primes() generator that has not started yet. """
+    return getattr(sequence, 'gi_code', None) is primes.__code__ \
+        and inspect.getgeneratorstate(sequence) == inspect.GEN_CREATED
+
+
+def _small_sieve(limit: int) -> List[int]:
+    """ Returns all the primes below limit, using a plain Sieve of Eratosthenes. """
+    if limit < 3:
+        return []
+
+    sieve = bytearray([1]) * limit
+    sieve[0] = sieve[1] = 0
+    for i in range(2, math.isqrt(limit - 1) + 1):
+        if sieve[i]:
+            sieve[i * i::i] = bytes(len(range(i * i, limit, i)))
+
+    return list(itertools.compress(range(limit), sieve))
+
+
+def _sieve_segment(lo: int, size: int, base_primes: List[int]) -> bytearray:
+    """
+    Sieves one segment of odd numbers. Entry i of the result is 1 if lo + 2 * i
+    is prime and 0 otherwise.
+
+    :param lo: the first (odd) number of the segment
+    :param size: the number of odd numbers in the segment
+    :param base_primes: ascending odd primes, covering every prime up to the
+     square root of the segment's upper end
+    """
+    segment = bytearray([1]) * size
+    hi = lo + 2 * size
+    if lo == 1:
+        segment[0] = 0
+
+    for p in base_primes:
+        start = p * p
+        if start >= hi:
+            break
+        if start < lo:
+            # First odd multiple of p that is >= lo
+            start = lo + (-lo) % p
+            if start % 2 == 0:
+                start += p
+        # Odd multiples of p are 2p apart, i.e. p entries apart in the segment
+        idx = (start - lo) // 2
+        segment[idx::p] = bytes(len(range(idx, size, p)))
+
+    return segment
+
+
 def primes() -> Iterator[int]:
-    """ Yields an infinite sequence of prime numbers. """
-    yield 2
-    n = 3
+    """
+    Yields an infinite sequence of prime numbers.
+
+    The primes are produced by a segmented Sieve of Eratosthenes over the odd
+    numbers, one segment of SEGMENT_SIZE entries at a time. Only the current
+    segment and the base primes up to the square root of its end are held in
+    memory. If the on-disk cache is enabled, the primes it covers are read
+    from it, and sieving starts where it ends.
+    """
+    table = _prime_table
+    if table is not None:
+        lo = table.limit + 1
+        yield from table.primes(lo)
+    else:
+        yield 2
+        lo = 3
+    limit = 0
+    base_primes = []
 
     while True:
-        if is_prime(n):
-            yield n
-        n += 2
+        hi = lo + 2 * SEGMENT_SIZE
+        if limit < math.isqrt(hi):
+            # Grow the base primes geometrically, so they are rarely rebuilt
+            limit = max(2 * limit, math.isqrt(hi))
+            base_primes = _small_sieve(limit + 1)[1:]
+        segment = _sieve_segment(lo, SEGMENT_SIZE, base_primes)
+        yield from itertools.compress(range(lo, hi, 2), segment)
+        lo = hi
+
+
+def _primes_between(lo: int, hi: int, base_primes: List[int] = None) -> Iterator[int]:
+    """
+    Yields the primes p with lo <= p < hi, in ascending order.
+
+    :param base_primes: the odd primes up to the square root of hi, if already known
+    """
+    if lo <= 2 < hi:
+        yield 2
+    lo = max(lo, 3) | 1
+    if lo >= hi:
+        return
+
+    if base_primes is None:
+        base_primes = _small_sieve(math.isqrt(hi - 1) + 1)[1:]
+    # Once there are many base primes, the per-prime loop overhead outweighs
+    # keeping the segment in cache, so widen the segments along with them
+    width = max(SEGMENT_SIZE, 32 * len(base_primes))
+
+    while lo < hi:
+        size = min(width, (hi - lo + 1) // 2)
+        segment = _sieve_segment(lo, size, base_primes)
+        yield from itertools.compress(range(lo, lo + 2 * size, 2), segment)
+        lo += 2 * size
+
+
+def _init_range_worker(base_primes: List[int]):
+    """ Stores the base primes in a primes_in_range() worker process. """
+    global _worker_base_primes
+    _worker_base_primes = base_primes
+
+
+def _range_chunk(lo: int, hi: int) -> array:
+    """ Returns the primes in [lo, hi) as a compact array. Runs in a worker process. """
+    return array('q', _primes_between(lo, hi, _worker_base_primes))
+
+
+def _range_chunks(lo: int, hi: int, workers: int) -> Iterator[array]:
+    """
+    Yields arrays holding the primes of consecutive chunks of [lo, hi), in
+    order. Only a couple of chunks per worker are in flight at any time.
+    """
+    base_primes = _small_sieve(math.isqrt(hi - 1) + 1)[1:]
+    bounds = ((start, min(start + RANGE_CHUNK_SIZE, hi)) for start in range(lo, hi, RANGE_CHUNK_SIZE))
+
+    if workers == 1 or hi - lo <= RANGE_CHUNK_SIZE:
+        for start, end in bounds:
+            yield array('q', _primes_between(start, end, base_primes))
+        return
+
+    executor = ProcessPoolExecutor(workers, initializer=_init_range_worker,
+                                   initargs=(base_primes,))
+    try:
+        pending = deque()
+        for start, end in bounds:
+            pending.append(executor.submit(_range_chunk, start, end))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def primes_in_range(lo: int, hi: int, workers: int = None, as_array: bool = False):
+    """
+    Returns the primes p with lo <= p < hi, in ascending order.
+
+    The range is split into chunks of RANGE_CHUNK_SIZE numbers, which are
+    sieved in parallel by a pool of worker processes. The base primes are
+    computed once and sent to each worker when it starts.
+
+    :param lo: an inclusive lower bound
+    :param hi: an exclusive upper bound
+    :param workers: the number of worker processes, all CPUs by default
+    :param as_array: if True, return a NumPy int64 array rather than an iterator
+    :return: an iterator streaming the primes, or a NumPy array of them
+    """
+    workers = workers or os.cpu_count() or 1
+    lo = max(lo, 2)
+    chunks = _range_chunks(lo, hi, workers) if lo < hi else iter(())
+
+    if as_array:
+        if np is None:
+            raise ImportError('primes_in_range(as_array=True) requires NumPy')
+        return np.concatenate([np.frombuffer(chunk, dtype=np.int64) for chunk in chunks]
+                              + [np.empty(0, dtype=np.int64)])
+
+    return itertools.chain.from_iterable(chunks)
+
+
+def _pack_bits(flags: bytes) -> bytes:
+    """ Packs a multiple of 8 flags (bytes of 0 or 1) into bits, little-endian. """
+    return int(flags.translate(_FLAG_TO_ASCII)[::-1], 2).to_bytes(len(flags) // 8, 'little')
+
 
+def _unpack_bits(data: bytes) -> bytes:
+    """ The inverse of _pack_bits(). """
+    bits = format(int.from_bytes(data, 'little'), '0{}b'.format(8 * len(data)))
+    return bits[::-1].encode('ascii').translate(_ASCII_TO_FLAG)
 
-def prime_factors(n: int) -> List[int]:
-    """ Returns a list of prime numbers with product n, in ascending order. """
-    p_gen = primes()
-    p_num = next(p_gen)
+
+class PrimeTable:
+    """
+    A bit-packed, odd-only prime table stored in a file and memory-mapped, so
+    that it is computed once and shared by every process that opens it.
+
+    The table is extended by writing a larger copy next to it and renaming it
+    over the original. Readers that already mapped the old file keep a valid,
+    smaller table, so concurrent readers never see a partial write.
+    """
+
+    def __init__(self, path: str, limit: int = CACHE_LIMIT, max_limit: int = CACHE_MAX_LIMIT):
+        """
+        Open the table at path, creating or extending it to cover limit.
+        param path: File holding the table
+        param limit: Numbers below this must be covered
+        param max_limit: The table never grows beyond this
+        """
+        self.path = path
+        self.max_limit = max_limit
+        self._inode = None
+        self._mm = None
+        self.limit = 0
+
+        self._open()
+        self.extend(limit)
+
+    def _open(self):
+        """
+        Map the file currently at self.path. A file that cannot be read, or
+        is not a whole prime table, is left alone, and treated as missing by
+        the caller, which then rewrites it.
+        return: True if the table was mapped
+        """
+        try:
+            with open(self.path, 'rb') as fh:
+                mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+                inode = os.fstat(fh.fileno()).st_ino
+        except (OSError, ValueError):
+            return False
+        if len(mm) < CACHE_HEADER.size:
+            return False
+        magic, limit = CACHE_HEADER.unpack_from(mm, 0)
+        if magic != CACHE_MAGIC or limit % 16 or len(mm) != CACHE_HEADER.size + limit // 16:
+            return False
+
+        # Earlier maps are not closed: live primes() iterators may still use them
+        self._mm = mm
+        self._inode = inode
+        self.limit = limit
+        return True
+
+    def extend(self, limit: int):
+        """
+        Make the table cover all numbers below limit, within max_limit.
+        param limit: Requested limit
+        return: None
+        """
+        limit = min(limit, self.max_limit)
+        if limit <= self.limit:
+            return
+
+        # Another process may have extended the table already
+        try:
+            if os.stat(self.path).st_ino != self._inode:
+                self._open()
+        except FileNotFoundError:
+            pass
+        if limit <= self.limit:
+            return
+
+        # Double at least, to amortize rewriting the file; keep whole bytes
+        new_limit = min(max(limit, 2 * self.limit), self.max_limit)
+        new_limit += -new_limit % 16
+        base_primes = _small_sieve(math.isqrt(new_limit) + 1)[1:]
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(CACHE_HEADER.pack(CACHE_MAGIC, new_limit))
+                if self._mm is not None:
+                    fh.write(self._mm[CACHE_HEADER.size:])
+                lo = self.limit + 1
+                while lo < new_limit:
+                    size = min(SEGMENT_SIZE, (new_limit - lo + 1) // 2)
+                    fh.write(_pack_bits(_sieve_segment(lo, size, base_primes)))
+                    lo += 2 * size
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        self._open()
+
+    def __contains__(self, n: int) -> bool:
+        """
+        Return whether n, which must be below the limit, is prime
+        """
+        if n % 2 == 0:
+            return n == 2
+        i = n >> 1
+        return bool(self._mm[CACHE_HEADER.size + (i >> 3)] >> (i & 7) & 1)
+
+    def primes(self, hi: int) -> Iterator[int]:
+        """
+        Yield the primes below hi, which must not exceed the limit, reading
+        the mapped table a page at a time.
+        param hi: Exclusive upper bound
+        return: Iterator over the primes
+        """
+        mm = self._mm
+        if hi > 2:
+            yield 2
+
+        page = mmap.PAGESIZE
+        end = CACHE_HEADER.size + (hi + 15) // 16
+        for start in range(CACHE_HEADER.size, end, page):
+            flags = _unpack_bits(mm[start:min(start + page, end)])
+            first = 16 * (start - CACHE_HEADER.size) + 1
+            yield from itertools.compress(range(first, min(first + 2 * len(flags), hi), 2), flags)
+
+
+def enable_cache(path: str = None, limit: int = CACHE_LIMIT, max_limit: int = CACHE_MAX_LIMIT) \
+        -> PrimeTable:
+    """
+    Turns on the on-disk prime table. primes(), is_prime() and elements_under()
+    then read from it, and elements_under() extends it as needed.
+
+    :param path: the table file, by default $PRIMES_CACHE or ~/.cache/primes.bin
+    :param limit: numbers below this are covered right away
+    :param max_limit: the table never grows beyond this
+    :return: the opened table
+    """
+    global _prime_table
+
+    if path is None:
+        path = os.environ.get('PRIMES_CACHE') or os.path.expanduser('~/.cache/primes.bin')
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    _prime_table = PrimeTable(path, limit, max_limit)
+    return _prime_table
+
+
+def disable_cache():
+    """ Turns off the on-disk prime table. """
+    global _prime_table
+    _prime_table = None
+
+
+def _spf(limit: int) -> array:
+    """
+    Returns a table whose entry i is the smallest prime factor of i, for all
+    i below limit. The table is cached, and only rebuilt when a larger limit
+    is requested.
+    """
+    global _spf_table
+
+    if len(_spf_table) < limit:
+        table = array('I', range(limit))
+        # Go through the primes in descending order, so that the smallest prime
+        # dividing each entry is the last one written to it
+        for p in reversed(_small_sieve(math.isqrt(limit - 1) + 1)):
+            table[p * p::p] = array('I', [p]) * len(range(p * p, limit, p))
+        _spf_table = table
+
+    return _spf_table
+
+
+def _pollard_rho(n: int) -> int:
+    """ Returns a nontrivial factor of the odd composite n, using Brent's variant of Pollard's rho. """
+    while True:
+        y = random.randrange(1, n)
+        c = random.randrange(1, n)
+        m = 128
+        g = r = q = 1
+
+        while g == 1:
+            x = y
+            for _ in range(r):
+                y = (y * y + c) % n
+            k = 0
+            while k < r and g == 1:
+                ys = y
+                for _ in range(min(m, r - k)):
+                    y = (y * y + c) % n
+                    q = q * abs(x - y) % n
+                g = math.gcd(q, n)
+                k += m
+            r *= 2
+
+        if g == n:
+            # The batched gcd overshot; step through the last batch one by one
+            g = 1
+            while g == 1:
+                ys = (ys * ys + c) % n
+                g = math.gcd(abs(x - ys), n)
+
+        if g != n:
+            return g
+
+
+def _factorize(n: int, table: array) -> List[int]:
+    """ Returns the prime factors of n >= 1, in no particular order. """
     factors = []
 
-    while n != 1:
-        if n % p_num == 0:
-            factors.append(p_num)
-            n /= p_num
+    if n >= len(table):
+        for p in SMALL_PRIMES:
+            while n % p == 0:
+                factors.append(p)
+                n //= p
+
+    if n >= len(table):
+        if is_prime(n):
+            factors.append(n)
         else:
-            p_num = next(p_gen)
+            d = _pollard_rho(n)
+            factors += _factorize(d, table)
+            factors += _factorize(n // d, table)
+        return factors
+
+    while n > 1:
+        p = table[n]
+        factors.append(p)
+        n //= p
 
     return factors
 
 
+def prime_factors(n: int, spf_limit: int = SPF_LIMIT) -> List[int]:
+    """
+    Returns a list of prime numbers with product n, in ascending order.
+
+    :param n: a positive integer
+    :param spf_limit: numbers below this are factored with the cached
+     smallest-prime-factor table, larger ones with Pollard's rho
+    """
+    if n < 1:
+        raise ValueError('prime_factors expects a positive integer, got {}'.format(n))
+
+    return sorted(_factorize(n, _spf(spf_limit)))
+
+
+def factorize_many(values, spf_limit: int = SPF_LIMIT) -> List[List[int]]:
+    """
+    Factors a batch of positive integers, reusing one smallest-prime-factor
+    table for all of them.
+
+    :param values: an iterable of positive integers (a list, a NumPy array...)
+    :param spf_limit: see prime_factors()
+    :return: the ascending prime factors of each value, in input order
+    """
+    table = _spf(spf_limit)
+    result = []
+
+    for n in values:
+        n = int(n)
+        if n < 1:
+            raise ValueError('factorize_many expects positive integers, got {}'.format(n))
+        result.append(sorted(_factorize(n, table)))
+
+    return result
+
+
 def semiprimes() -> Iterator[int]:
-    """ Yields an infinite sequence of semiprimes. """
-    val = 1
+    """
+    Yields an infinite sequence of semiprimes.
+
+    Each segment of integers is sieved by the powers of the primes up to the
+    square root of its end, counting the small prime factors of every entry.
+    What is left of an entry after removing those factors is 1 or a single
+    large prime, so n is a semiprime exactly when it has one small prime
+    factor and is not itself that prime, or is the product of two small
+    primes. The latter are few and enumerated directly.
+    """
+    lo = 1
+    limit = 0
+    base_primes = []
+
+    while True:
+        # Grow the segments with the base primes, so that the per-prime
+        # overhead stays small relative to the work done in each segment
+        size = max(SEGMENT_SIZE, limit)
+        hi = lo + size
+        root = math.isqrt(hi - 1)
+        if limit < root:
+            limit = max(2 * limit, root)
+            base_primes = _small_sieve(limit + 1)
+        small = base_primes[:bisect.bisect_right(base_primes, root)]
+
+        omega = bytearray(size)
+        for p in small:
+            power = p
+            while power < hi:
+                idx = (-lo) % power
+                omega[idx::power] = omega[idx::power].translate(_OMEGA_INC)
+                power *= p
 
+        segment = bytearray(omega.translate(_OMEGA_ONE))
+        for p in small[bisect.bisect_left(small, lo):]:
+            segment[p - lo] = 0
+        for i, p in enumerate(small):
+            if p * p >= hi:
+                break
+            first = bisect.bisect_left(small, max(p, -(-lo // p)), i)
+            for q in small[first:]:
+                if p * q >= hi:
+                    break
+                segment[p * q - lo] = 1
+
+        yield from itertools.compress(range(lo, hi), segment)
+        lo = hi
+
+
+def prime_pi(x: int) -> int:
+    """
+    Returns the number of primes <= x, using Lucy_Hedgehog's algorithm in
+    O(x^(3/4)) time and O(x^(1/2)) memory. The inner updates are vectorized
+    with NumPy when it is installed (which requires x < 2^63).
+
+    For every v of the form x // i the algorithm keeps S(v), the count of
+    numbers in [2, v] not yet crossed off. Sieving by each prime p <= sqrt(x)
+    removes the numbers whose smallest prime factor is p from all S(v) at once.
+    """
+    if x < 2:
+        return 0
+
+    r = math.isqrt(x)
+    # small[v] = S(v) for v <= r, large[i] = S(x // i) for i <= r
+    small = [v - 1 for v in range(r + 1)]
+    large = [0] + [x // i - 1 for i in range(1, r + 1)]
+    if np is not None and x < 1 << 63:
+        small = np.array(small, dtype=np.int64)
+        large = np.array(large, dtype=np.int64)
+
+    for p in range(2, r + 1):
+        if small[p] == small[p - 1]:
+            continue  # p is not prime
+        crossed = small[p - 1]
+        square = p * p
+        last = min(r, x // square)
+        # For i <= mid, x // (i * p) is a large index, above that a small one
+        mid = min(last, r // p)
+
+        if np is not None and x < 1 << 63:
+            large[1:mid + 1] -= large[p:mid * p + 1:p] - crossed
+            large[mid + 1:last + 1] -= small[x // (np.arange(mid + 1, last + 1) * p)] - crossed
+            small[square:] -= small[np.arange(square, r + 1) // p] - crossed
+        else:
+            for i in range(1, mid + 1):
+                large[i] -= large[i * p] - crossed
+            for i in range(mid + 1, last + 1):
+                large[i] -= small[x // (i * p)] - crossed
+            for v in range(r, square - 1, -1):
+                small[v] -= small[v // p] - crossed
+
+    return int(large[1])
+
+
+def nth_prime(n: int) -> int:
+    """
+    Returns the prime at index n, counting from 0 as nth_element() does, so
+    nth_prime(0) == 2.
+
+    An analytic estimate of the answer is corrected with prime_pi() and a
+    segmented sieve over the few numbers between the estimate and the answer.
+    """
+    if n < 0:
+        raise ValueError('nth_prime expects a non-negative index, got {}'.format(n))
+    if n < len(SMALL_PRIMES):
+        return SMALL_PRIMES[n]
+
+    # Count from 1 from here on, and estimate p_k by Cipolla's expansion
+    k = n + 1
+    log_k = math.log(k)
+    log_log_k = math.log(log_k)
+    guess = int(k * (log_k + log_log_k - 1 + (log_log_k - 2) / log_k))
+    window = max(2 * SEGMENT_SIZE, math.isqrt(guess))
+    count = prime_pi(guess)
+
+    if count < k:
+        # The answer is above the guess: count primes upwards
+        lo = guess + 1
+        while True:
+            found = list(_primes_between(lo, lo + window))
+            if count + len(found) >= k:
+                return found[k - count - 1]
+            count += len(found)
+            lo += window
+
+    # The answer is at most the guess: count primes downwards
+    hi = guess + 1
     while True:
-        if len(prime_factors(val)) == 2:
-            yield val
-        val += 1
+        found = list(_primes_between(max(2, hi - window), hi))
+        if count - len(found) < k:
+            return found[k - (count - len(found)) - 1]
+        count -= len(found)
+        hi -= window
+
+
+if os.environ.get('PRIMES_CACHE'):
+    # The cache only speeds things up; importing must not fail because of it
+    try:
+        enable_cache()
+    except OSError:
+        disable_cache()
 
 
 if __name__ == '__main__':
     assert all(is_prime(n) for n in (2, 3, 5, 7))
-    assert all(not is_prime(n) for n in (4, 6, 8, 9))
+    assert all(not is_prime(n) for n in (0, 1, 4, 6, 8, 9, 561))
+    assert is_prime(2 ** 61 - 1) and not is_prime(2 ** 64 + 1)
+    assert is_prime_many([0, 1, 2, 9, 97, 10007]) == [False, False, True, False, True, True]
     assert list(elements_under(primes(), 10)) == [2, 3, 5, 7]
     assert list(elements_under(semiprimes(), 10)) == [4, 6, 9]
     assert nth_element(primes(), 2) == 5
     assert nth_element(semiprimes(), 2) == 9
+    assert list(primes_in_range(90, 110, workers=1)) == [97, 101, 103, 107, 109]
+    assert prime_pi(10 ** 6) == 78498 and nth_prime(78497) == 999983
     assert list(elements_under(primes(), 1386, lambda p: not 1386 % p)) == [2, 3, 7, 11]
     assert prime_factors(1386) == [2, 3, 3, 7, 11]
+    assert prime_factors((2 ** 61 - 1) * 1000003 ** 2) == [1000003, 1000003, 2 ** 61 - 1]
+    assert factorize_many([1, 12, 97]) == [[], [2, 2, 3], [97]]
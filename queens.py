@@ -13,6 +13,14 @@ $ python3 queens.py -v 4
 (2, 4, 1, 3)
 (3, 1, 4, 2)
 4-Queens has 2 solutions
+$ python3 queens.py -u 8
+8-Queens has 92 solutions, 12 unique
+
+The board is kept as three bitmasks of the columns, the diagonals going
+left and the diagonals going right that are attacked by the queens placed
+so far. Bit j - 1 stands for column j. Moving down a row, the diagonal
+masks shift by one column, and the free squares of the row are the bits
+set in none of the masks.
 '''
 import sys
 
@@ -22,106 +30,179 @@ def usage():
     Print the usage message
     return: None
     """
-    print("Usage: Queens [-v] number")
+    print("Usage: Queens [-v] [-u] number")
     print("Option: -v verbose output, print all solutions")
+    print("        -u also count the unique solutions, up to rotations and reflections")
+    print("           (with -v, print only the unique solutions)")
 
 
-def print_board(board):
+def print_board(solution):
     """
     Print the board. Used in the verbose option.
-    board: Board detailing the position of all the queens
+    solution: Tuple of the column of the queen in each row
     return: None
     """
-    sys.stdout.write("(")
+    print("(" + ", ".join(str(col) for col in solution) + ")")
 
-    for i in range(1, n):
-        print(board[i][0], end=', ')
-    print(board[n][0], end='')
 
-    print(")")
-
-
-def place_queen(board, row, col):
+def count_solutions(n):
     """
-    Identify an available spot and place the queen there.
-    Update the squares that are covered by the new queen.
-    param board: Board to be updated.
-    param row: Row being updated
-    param col: Column being updated
-    return: None
+    Count the solutions for a board of the given size. The mirror image of
+    a solution across the middle column is also a solution, so only the
+    first queens in the left half are searched, and their count doubled.
+    For an odd size, a solution with the first queen in the middle column
+    mirrors to one with the first queen in the middle too. Its second queen
+    is never in the middle column, though, so those solutions are counted
+    by searching the second queens in the left half, and doubling.
+    param n: Board size
+    return: Number of solutions
     """
-    board[row][col] = 1
-    board[row][0] = col
+    if n < 2:
+        return 1
+    full = (1 << n) - 1
+    half = (1 << (n // 2)) - 1
+
+    def place(cols, left, right, rows_left, free):
+        """
+        Count the ways to fill the remaining rows, with the queen of the
+        next row on one of the free squares. Only one column is left for
+        the last row, so it is counted without recursing.
+        """
+        if rows_left == 1:
+            return 1 if free else 0
+
+        num_solutions = 0
+        while free:
+            bit = free & -free
+            free ^= bit
+            next_cols, next_left, next_right = \
+                cols | bit, (left | bit) >> 1, ((right | bit) << 1) & full
+            num_solutions += place(next_cols, next_left, next_right, rows_left - 1,
+                                   full & ~(next_cols | next_left | next_right))
+
+        return num_solutions
+
+    num_solutions = 2 * place(0, 0, 0, n, half)
+    if n % 2:
+        middle = 1 << (n // 2)
+        num_solutions += 2 * place(middle, middle >> 1, middle << 1, n - 1,
+                                   half & ~(middle >> 1))
 
-    for i in range(row + 1, n + 1):
-        for j in range(1, n + 1):
-            if j in (col - (i - row), col, col + (i - row)):
-                board[i][j] -= 1
+    return num_solutions
 
 
-def remove_queen(board, row, col):
+def iter_solutions(n, first_columns=None):
     """
-    Remove the queen. If a queen can't be placed, we need to remove a
-    preceding queen and try another arrangement. The board positions
-    covered by the now removed queen should be updated.
-    param board: Board to be updated.
-    param row: Row being updated
-    param col: Column being updated
-    return: None
+    Generate the solutions for a board of the given size, in increasing
+    order of the columns of the queens in the first rows
+    param n: Board size
+    param first_columns: If given, only the solutions with the first queen
+                         in one of these columns (1 to n)
+    return: Generator of tuples of the column (1 to n) of the queen in each row
+    """
+    full = (1 << max(n, 0)) - 1
+    solution = []
+
+    def place(cols, left, right, free):
+        """
+        Generate the ways to fill the remaining rows, with the queen of the
+        next row on one of the free squares
+        """
+        if cols == full:
+            yield tuple(solution)
+            return
+
+        while free:
+            bit = free & -free
+            free ^= bit
+            solution.append(bit.bit_length())
+            next_cols, next_left, next_right = \
+                cols | bit, (left | bit) >> 1, ((right | bit) << 1) & full
+            yield from place(next_cols, next_left, next_right,
+                             full & ~(next_cols | next_left | next_right))
+            solution.pop()
+
+    if first_columns is None:
+        return place(0, 0, 0, full)
+    return place(0, 0, 0, full & sum(1 << (col - 1) for col in set(first_columns)))
+
+
+def symmetries(solution):
     """
-    board[row][col] = 0
-    board[row][0] = 0
+    Return the images of a solution under the 8 symmetries of the board:
+    the rotations, and the reflections across the middle row, the middle
+    column and the two diagonals
+    param solution: Tuple of the column (1 to n) of the queen in each row
+    return: List of the 8 images, as tuples of the same form
+    """
+    n = len(solution)
+    transposed = [0] * n
+    for row, col in enumerate(solution, 1):
+        transposed[col - 1] = row
+
+    images = []
+    for board in (tuple(solution), tuple(transposed)):
+        mirrored = tuple(n + 1 - col for col in board)
+        images += [board, mirrored, board[::-1], mirrored[::-1]]
 
-    for i in range(row + 1, n + 1):
-        for j in range(1, n + 1):
-            if j in (col - (i - row), col, col + (i - row)):
-                board[i][j] += 1
+    return images
 
 
-def find_solutions(board, i, mode):
+def fundamental_solutions(n):
     """
-    The top level recursive function, that places and removes
-    queens as required to find the solution(s).
-    param board: Board to be updated.
-    param i: Start with the first row till the board size
-    param mode: Verbose or normal
-    return: None
+    Generate one solution of each class of solutions that are symmetries of
+    each other: the one that is the smallest tuple. Mirroring it across the
+    middle column would give a smaller tuple if its first queen was in the
+    right half, so only the first queens in the left half and the middle
+    are searched.
+    param n: Board size
+    return: Generator of tuples of the column (1 to n) of the queen in each row
     """
-    num_solutions = 0
+    for solution in iter_solutions(n, range(1, (n + 1) // 2 + 1)):
+        if solution == min(symmetries(solution)):
+            yield solution
 
-    if i > n:
-        if mode == "VERBOSE":
-            print_board(board)
-        return 1
 
-    for j in range(1, n+1):
-        if B[i][j] == 0:
-            place_queen(board, i, j)
-            num_solutions += find_solutions(B, i+1, mode)
-            remove_queen(board, i, j)
-
-    return num_solutions
+def count_unique_solutions(n):
+    """
+    Count the solutions for a board of the given size that are not
+    symmetries of each other
+    param n: Board size
+    return: Number of fundamental solutions
+    """
+    return sum(1 for _ in fundamental_solutions(n))
 
 
 if __name__ == '__main__':
-    MODE = "COUNT"
+    options = sys.argv[1:-1]
 
-    if len(sys.argv) < 2 or len(sys.argv) > 3:
+    if len(sys.argv) < 2 or any(option not in ("-v", "-u") for option in options):
         usage()
         sys.exit(1)
 
-    if len(sys.argv) == 3:
-        if sys.argv[1] != "-v":
-            usage()
-            sys.exit(1)
-        else:
-            MODE = "VERBOSE"
+    MODE = "VERBOSE" if "-v" in options else "COUNT"
+    unique = "-u" in options
 
     try:
-        n = int(sys.argv[-1])
-        B = [[0 for i in range(n + 1)] for j in range(n + 1)]
-        solutionsCount = find_solutions(B, 1, MODE)
-        print("{}-Queens has {} solutions".format(n, solutionsCount))
+        board_size = int(sys.argv[-1])
     except ValueError:
         usage()
         sys.exit(1)
+
+    if MODE == "VERBOSE":
+        solutionsCount = 0
+        for board in (fundamental_solutions if unique else iter_solutions)(board_size):
+            print_board(board)
+            solutionsCount += 1
+        if unique:
+            uniqueCount, solutionsCount = solutionsCount, count_solutions(board_size)
+    else:
+        solutionsCount = count_solutions(board_size)
+        if unique:
+            uniqueCount = count_unique_solutions(board_size)
+
+    if unique:
+        print("{}-Queens has {} solutions, {} unique".format(board_size, solutionsCount,
+                                                             uniqueCount))
+    else:
+        print("{}-Queens has {} solutions".format(board_size, solutionsCount))